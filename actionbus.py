@@ -0,0 +1,84 @@
+import collections
+from typing import Any, Callable, Iterable
+
+Handler = Callable[[Any], None]
+BatchHandler = Callable[[list[Any]], None]
+
+
+class ActionBus:
+    """
+    Routes actions to the handler registered for their type through a
+    table, resolved once per concrete type along its MRO, instead of a
+    chain of isinstance checks. A handler registered with registerBatch
+    gets every run of consecutive actions for it in one call. Actions put
+    on queue are handled first thing in the next dispatch.
+    """
+
+    def __init__(self) -> None:
+        self.queue = collections.deque[Any]()
+
+        self._registered = dict[type, tuple[Callable, bool]]()
+        # concrete action type to its handler and whether it takes batches
+        self._table = dict[type, tuple[Callable, bool] | None]()
+
+        self._batch = list[Any]()
+        self._batchHandler: BatchHandler | None = None
+
+    def register(self, actionType: type, handler: Handler):
+        self._registered[actionType] = (handler, False)
+        self._table.clear()
+
+    def registerBatch(self, actionType: type, handler: BatchHandler):
+        """handler is given a list it must not keep, it is reused for the next batch"""
+        self._registered[actionType] = (handler, True)
+        self._table.clear()
+
+    def _lookup(self, actionType: type) -> tuple[Callable, bool] | None:
+        if actionType not in self._table:
+            entry = None
+
+            for base in actionType.__mro__:
+                if base in self._registered:
+                    entry = self._registered[base]
+                    break
+
+            self._table[actionType] = entry
+
+        return self._table[actionType]
+
+    def dispatch(self, actions: Iterable[Any]):
+        """Handles everything queued before this call, then actions, in order"""
+        for _ in range(len(self.queue)):
+            self._handle(self.queue.popleft())
+
+        for action in actions:
+            self._handle(action)
+
+        self._flush()
+
+    def _handle(self, action: Any):
+        entry = self._lookup(type(action))
+
+        if entry == None:
+            return  # nothing handles this type
+
+        handler, batched = entry
+
+        if handler != self._batchHandler:
+            self._flush()
+
+        if batched:
+            self._batchHandler = handler
+            self._batch.append(action)
+        else:
+            handler(action)
+
+    def _flush(self):
+        if self._batchHandler == None:
+            return
+
+        handler = self._batchHandler
+        self._batchHandler = None
+
+        handler(self._batch)
+        self._batch.clear()
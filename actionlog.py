@@ -0,0 +1,294 @@
+import collections
+import os
+import struct
+import threading
+from typing import BinaryIO, Callable, Iterator
+
+import numpy as np
+
+import items
+from controller import (Action, AddCoinsAction, AddItemAction,
+                        ChangeInventorySelectionAction, Character, Coord,
+                        HarvestAreaAction, HoeAreaAction, HoeGroundAction,
+                        IncrementDayAction, MoveCharacterAction,
+                        PlantAreaAction, PlantSeedAction, TileArea, World)
+from items import Seed
+from savegame import RECORD_FORMAT, WorldSnapshot
+
+# bump whenever the layout below changes, logs of other versions are refused
+LOG_VERSION = 3
+LOG_MAGIC = b"MDAL"
+# magic, version, world epoch, player epoch, then the starting state as a
+# full save record
+HEADER_FORMAT = struct.Struct("<4sIqq")
+# frame number, clock time in nanoseconds, action count
+FRAME_FORMAT = struct.Struct("<IqH")
+# action code in front of every action
+CODE_FORMAT = struct.Struct("<B")
+# pos, width, height and whether a packed mask follows
+AREA_FORMAT = struct.Struct("<iiHH?")
+
+Frame = tuple[int, int, list[Action]]
+
+
+def _writeArea(area: TileArea) -> bytes:
+    data = AREA_FORMAT.pack(area.pos.x, area.pos.y, area.width,
+                            area.height, area.mask is not None)
+
+    if area.mask is not None:
+        data += np.packbits(area.mask, axis=None).tobytes()
+
+    return data
+
+
+def _readArea(buffer: bytes, offset: int) -> tuple[TileArea, int]:
+    x, y, width, height, masked = AREA_FORMAT.unpack_from(buffer, offset)
+    offset += AREA_FORMAT.size
+
+    mask = None
+    if masked:
+        length = -(-(width * height) // 8)
+        bits = np.frombuffer(buffer, np.uint8, length, offset)
+        mask = np.unpackbits(bits, count=width * height).astype(
+            bool).reshape(width, height)
+        offset += length
+
+    return (TileArea(Coord(x, y), width, height, mask), offset)
+
+
+def _seed(id: int) -> Seed:
+    seed = items.itemWithID(id)
+    assert (isinstance(seed, Seed))
+
+    return seed
+
+
+class ActionCodec:
+    """How one action type is written to a log and read back"""
+
+    __slots__ = ("code", "format", "pack", "unpack")
+
+    def __init__(self, code: int, format: str, pack: Callable[[Action], tuple], unpack: Callable[..., Action]) -> None:
+        self.code = code
+        self.format = struct.Struct("<" + format)
+        self.pack = pack
+        self.unpack = unpack
+
+
+# every action that can be recorded, codes are only ever added
+CODECS: dict[type, ActionCodec] = {
+    MoveCharacterAction: ActionCodec(0, "bb", lambda a: (a.x, a.y),
+                                     MoveCharacterAction),
+    ChangeInventorySelectionAction: ActionCodec(1, "B", lambda a: (a.selection,),
+                                                ChangeInventorySelectionAction),
+    HoeGroundAction: ActionCodec(2, "ii", lambda a: (a.pos.x, a.pos.y),
+                                 lambda x, y: HoeGroundAction(Coord(x, y))),
+    PlantSeedAction: ActionCodec(3, "iiH", lambda a: (a.pos.x, a.pos.y, a.seed.id),
+                                 lambda x, y, seed: PlantSeedAction(Coord(x, y), _seed(seed))),
+    IncrementDayAction: ActionCodec(4, "", lambda a: (),
+                                    IncrementDayAction),
+    AddCoinsAction: ActionCodec(5, "q", lambda a: (a.amount,),
+                                AddCoinsAction),
+    AddItemAction: ActionCodec(6, "HI", lambda a: (a.item.id, a.count),
+                               lambda id, count: AddItemAction(items.itemWithID(id), count)),
+    # the area follows these
+    HoeAreaAction: ActionCodec(7, "", lambda a: (),
+                               HoeAreaAction),
+    PlantAreaAction: ActionCodec(8, "H", lambda a: (a.seed.id,),
+                                 lambda area, seed: PlantAreaAction(area, _seed(seed))),
+    HarvestAreaAction: ActionCodec(9, "", lambda a: (),
+                                   HarvestAreaAction),
+}
+
+_byCode = {codec.code: codec for codec in CODECS.values()}
+
+# actions whose area is written after their fields
+_AREA_ACTIONS = (HoeAreaAction, PlantAreaAction, HarvestAreaAction)
+_AREA_CODES = {CODECS[action].code for action in _AREA_ACTIONS}
+
+
+class ActionRecorder:
+    """
+    Writes the actions of every frame and the clock time they were
+    handled at to a binary log, after a snapshot of the world and player
+    it starts from. Replaying the log through a world on a FixedClock
+    reproduces the session exactly. Frames are encoded on the caller's
+    thread and written by a background thread in batches, like
+    PositionTelemetry, but none are ever dropped.
+    """
+
+    def __init__(self, path: str, world: World, player: Character, flushInterval: float = 0.5) -> None:
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.file: BinaryIO = open(path, "wb")
+        self.frame = 0
+        self.flushInterval = flushInterval
+
+        self.file.write(HEADER_FORMAT.pack(
+            LOG_MAGIC, LOG_VERSION, world.epoch, player.epoch))
+        self.file.write(WorldSnapshot.capture(world, player).pack())
+
+        self._buffer = collections.deque[bytes]()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="action-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, now: int, actions: list[Action]):
+        """Queues one frame, actions without a codec are left out"""
+        recorded = [action for action in actions if type(
+            action) in CODECS]
+
+        parts = [FRAME_FORMAT.pack(self.frame, now, len(recorded))]
+
+        for action in recorded:
+            codec = CODECS[type(action)]
+
+            parts.append(CODE_FORMAT.pack(codec.code))
+            parts.append(codec.format.pack(*codec.pack(action)))
+
+            if isinstance(action, _AREA_ACTIONS):
+                parts.append(_writeArea(action.area))
+
+        self._buffer.append(b"".join(parts))
+        self.frame += 1
+
+    def _run(self):
+        while not self._stop.wait(self.flushInterval):
+            self._flush()
+
+    def _flush(self):
+        batch = list[bytes]()
+
+        while len(self._buffer) > 0:
+            batch.append(self._buffer.popleft())
+
+        if len(batch) > 0:
+            self.file.write(b"".join(batch))
+
+    def close(self):
+        """Writes out every queued frame and closes the file"""
+        self._stop.set()
+        self._thread.join()
+
+        self._flush()
+        self.file.close()
+
+
+class ActionLog:
+    """
+    A recorded session read back from a log. A log cut short by a crash or
+    corrupt part way keeps the complete frames before that point.
+    """
+
+    def __init__(self, worldEpoch: int, playerEpoch: int, start: WorldSnapshot, frames: list[Frame]) -> None:
+        self.worldEpoch = worldEpoch
+        self.playerEpoch = playerEpoch
+        self.start = start
+        # frame number, clock time and actions of every frame, in order
+        self.frames = frames
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __iter__(self) -> Iterator[Frame]:
+        return iter(self.frames)
+
+    def restore(self, world: World, player: Character):
+        """Puts world and player back in the state and at the epochs the recording started from"""
+        self.start.apply(world, player)
+
+        world.epoch = self.worldEpoch
+        player.epoch = self.playerEpoch
+
+    @staticmethod
+    def read(path: str) -> "ActionLog":
+        with open(path, "rb") as file:
+            buffer = file.read()
+
+        magic, version, worldEpoch, playerEpoch = HEADER_FORMAT.unpack_from(
+            buffer)
+
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not an action log")
+        if version != LOG_VERSION:
+            raise ValueError(
+                f"{path} is version {version}, only {LOG_VERSION} can be read")
+
+        offset = HEADER_FORMAT.size
+        kind, length, _ = RECORD_FORMAT.unpack_from(buffer, offset)
+        offset += RECORD_FORMAT.size
+
+        start = WorldSnapshot.unpack(kind, buffer[offset:offset + length])
+        offset += length
+
+        frames = list[Frame]()
+
+        try:
+            while offset < len(buffer):
+                frame, now, count = FRAME_FORMAT.unpack_from(buffer, offset)
+                offset += FRAME_FORMAT.size
+
+                actions = list[Action]()
+                for _ in range(count):
+                    (code,) = CODE_FORMAT.unpack_from(buffer, offset)
+
+                    if code not in _byCode:
+                        raise ValueError(f"unknown action code {code}")
+
+                    codec = _byCode[code]
+                    fields = codec.format.unpack_from(
+                        buffer, offset + CODE_FORMAT.size)
+                    offset += CODE_FORMAT.size + codec.format.size
+
+                    if code in _AREA_CODES:
+                        area, offset = _readArea(buffer, offset)
+                        fields = (area,) + fields
+
+                    actions.append(codec.unpack(*fields))
+
+                frames.append((frame, now, actions))
+        except (struct.error, ValueError):
+            pass  # the last frame was never finished or is corrupt
+
+        return ActionLog(worldEpoch, playerEpoch, start, frames)
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import io
+    import time
+
+    from headless import HeadlessRunner
+
+    parser = argparse.ArgumentParser(
+        description="Replays a recorded session without a display, as fast as possible")
+    parser.add_argument("path")
+    parser.add_argument("--sparse", action="store_true",
+                        help="store tiles in sparse chunks")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="replay this many times, to time it")
+    args = parser.parse_args()
+
+    log = ActionLog.read(args.path)
+    runner: HeadlessRunner | None = None
+
+    start = time.perf_counter()
+    # the world logs every tile it sets
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.repeat):
+            runner = HeadlessRunner(sparse=args.sparse)
+            runner.replay(log)
+    elapsed = time.perf_counter() - start
+
+    assert (runner != None)
+    world, player = runner.world, runner.player
+    print(f"replayed {len(log)} frames {args.repeat} times in {elapsed:.3f}s "
+          f"({len(log) * args.repeat / elapsed:.0f} frames/s)")
+    print(f"player at {player.pos.x:.3f}, {player.pos.y:.3f} facing {player.direction.name}, "
+          f"day {world.day}, time {world.time}, coins {world.coins}, "
+          f"{sum(1 for _ in world._tiles.populated())} tiles")
@@ -0,0 +1,391 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Callable
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+from shapely import geometry  # type: ignore
+
+import game
+import items
+from collision import CollisionGrid
+from constants import *
+from controller import (TICK_LENGTH, Character, Coord, HarvestAreaAction,
+                        HoeAreaAction,
+                        IncrementDayAction, InventoryManager,
+                        MoveCharacterAction, PlantAreaAction, TileArea, World)
+from entities import EntityManager
+from items import Item, ItemStack, Seed
+from timing import FixedClock
+
+# every benchmark is seeded with this, so runs are comparable
+SEED = 1
+
+# a benchmark sets up its state and returns the step that gets timed
+Step = Callable[[], None]
+
+
+def measure(step: Step, repeat: int, warmup: int) -> dict[str, float]:
+    """Runs step warmup times untimed, then times repeat runs of it"""
+    for _ in range(warmup):
+        step()
+
+    times = np.zeros(repeat, np.int64)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        step()
+        times[i] = time.perf_counter_ns() - start
+
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]).tolist()
+
+    return {
+        "runs": repeat,
+        "mean_ns": float(times.mean()),
+        "min_ns": float(times.min()),
+        "p50_ns": p50,
+        "p95_ns": p95,
+        "p99_ns": p99,
+    }
+
+
+def fieldArea(world: World, crops: int) -> TileArea:
+    """A square field of about crops cells in the top left of world"""
+    width, height = world._tiles.width, world._tiles.height
+    side = max(int(crops ** 0.5), 1)
+
+    return TileArea(Coord(0, 0), min(side, width), min(-(-crops // side), height))
+
+
+def plantField(world: World, crops: int) -> TileArea:
+    """Tills and plants the field of about crops cells"""
+    field = fieldArea(world, crops)
+
+    seed = items.itemWithID(1)
+    assert (isinstance(seed, Seed))
+
+    world.update([HoeAreaAction(field)])
+    world.update([PlantAreaAction(field, seed)])
+
+    return field
+
+
+def worldUpdate(size: tuple[int, int], crops: int, sparse: bool) -> Step:
+    """One World.update a game tick apart, so growth advances every step"""
+    clock = FixedClock()
+    world = World(clock, sparse, size)
+    plantField(world, crops)
+
+    def step():
+        clock.advance(TICK_LENGTH + 1)
+        world.update([])
+
+    return step
+
+
+def worldSeason(size: tuple[int, int], crops: int, sparse: bool) -> Step:
+    """
+    A season of farming in one World.update: till and plant the field,
+    skip the days until the crop matures, then harvest it.
+    """
+    world = World(FixedClock(), sparse, size)
+    field = fieldArea(world, crops)
+
+    seed = items.itemWithID(1)
+    assert (isinstance(seed, Seed))
+
+    actions = [HoeAreaAction(field), PlantAreaAction(field, seed)] + \
+        [IncrementDayAction() for _ in range(seed.plants.matures)] + \
+        [HarvestAreaAction(field)]
+
+    def step():
+        world.update(actions)
+
+    return step
+
+
+def renderWorld(size: tuple[int, int], crops: int, sparse: bool) -> Step:
+    """DrawableWorld.renderWorld followed by baking every overlay chunk of the map"""
+    world = game.DrawableWorld(FixedClock(), sparse, size)
+    plantField(world, crops)
+
+    columns = -(-size[0] // game.CHUNK_TILES)
+    rows = -(-size[1] // game.CHUNK_TILES)
+    world.overlayChunks.budget = columns * rows
+
+    def step():
+        world.renderWorld()
+
+        for cx in range(columns):
+            for cy in range(rows):
+                world.overlayChunks.get(cx, cy)
+
+    return step
+
+
+def moveCharacter(polygons: int) -> Step:
+    """Character.update walking back and forth with polygons extra collision shapes scattered over the map"""
+    clock = FixedClock()
+    world = World(clock)
+
+    generator = random.Random(SEED)
+    for _ in range(polygons):
+        x = generator.uniform(0, WORLD_WIDTH)
+        y = generator.uniform(0, WORLD_HEIGHT)
+        size = generator.uniform(2, CELL_SIZE)
+
+        if generator.random() < 0.5:
+            shape = geometry.box(x, y, x + size, y + size)
+        else:
+            shape = geometry.Polygon(
+                [(x, y), (x + size, y + (size / 3)), (x + (size / 2), y + size)])
+
+        world.collisionObjects.append(shape)
+    world.collisionGrid = CollisionGrid(world.collisionObjects)
+
+    character = Character(world)
+    moves = [[MoveCharacterAction(1, 0)], [MoveCharacterAction(-1, 0)],
+             [MoveCharacterAction(0, 1)], [MoveCharacterAction(0, -1)]]
+    frame = [0]
+
+    def step():
+        clock.advance(int(1e9 / FRAME_LIMIT))
+        character.update(moves[(frame[0] // 60) % len(moves)])
+        frame[0] += 1
+
+    return step
+
+
+def entitiesUpdate(count: int) -> Step:
+    """EntityManager.update with count wandering entities, a frame apart"""
+    clock = FixedClock()
+    world = World(clock)
+
+    entities = EntityManager(world, seed=SEED)
+    entities.spawnRandom(count)
+
+    def step():
+        clock.advance(int(1e9 / FRAME_LIMIT))
+        entities.update()
+
+    return step
+
+
+def drawWorld(instance: "game.Game", count: int) -> Step:
+    """Game.drawWorld with count entities spread over the map"""
+    instance.entities = EntityManager(instance.world, seed=SEED)
+    instance.entities.spawnRandom(count)
+
+    def step():
+        instance.drawWorld()
+
+    return step
+
+
+def itemImages(instance: "game.Game") -> Step:
+    """ItemRenderer.getImage over every item and a spread of stack counts"""
+    renderer = instance.itemRenderer
+    generator = random.Random(SEED)
+
+    slots = list[Item | ItemStack]()
+    for item in items.registry:
+        if item.stackable:
+            slots.extend(ItemStack(item, generator.randint(1, 99))
+                         for _ in range(20))
+        else:
+            slots.append(item)
+
+    def step():
+        for slot in slots:
+            renderer.getImage(slot)
+
+    return step
+
+
+def drawHUD(instance: "game.Game") -> Step:
+    instance.processInputs()
+
+    def step():
+        instance.drawHUD()
+
+    return step
+
+
+def addItems(count: int) -> Step:
+    """InventoryManager.addItem for count items spread over every item type, into a fresh inventory"""
+    everything = list(items.registry)
+    generator = random.Random(SEED)
+    chosen = [generator.choice(everything) for _ in range(count)]
+
+    def step():
+        inventory = InventoryManager(4)
+
+        # addItem logs every call
+        with contextlib.redirect_stdout(io.StringIO()):
+            for item in chosen:
+                inventory.addItem(item)
+
+    return step
+
+
+def parseSize(text: str) -> tuple[int, int]:
+    width, height = text.lower().split("x")
+
+    return (int(width), int(height))
+
+
+def gitCommit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runAll(args: argparse.Namespace) -> list[dict]:
+    sizes = [parseSize(size) for size in args.sizes.split(",")]
+    cropCounts = [int(count) for count in args.crops.split(",")]
+    polygonCounts = [int(count) for count in args.polygons.split(",")]
+    npcCounts = [int(count) for count in args.npcs.split(",")]
+
+    cases = list[tuple[str, dict, Callable[[], Step]]]()
+
+    for size in sizes:
+        for crops in cropCounts:
+            if crops > size[0] * size[1]:
+                continue
+
+            for sparse in [False, True]:
+                params = {"size": f"{size[0]}x{size[1]}",
+                          "crops": crops, "sparse": sparse}
+
+                cases.append(("world.update", params,
+                              lambda size=size, crops=crops, sparse=sparse: worldUpdate(size, crops, sparse)))
+                cases.append(("world.season", params,
+                              lambda size=size, crops=crops, sparse=sparse: worldSeason(size, crops, sparse)))
+                cases.append(("renderWorld", params,
+                              lambda size=size, crops=crops, sparse=sparse: renderWorld(size, crops, sparse)))
+
+    for polygons in polygonCounts:
+        cases.append(("character.move", {"polygons": polygons},
+                      lambda polygons=polygons: moveCharacter(polygons)))
+
+    # no telemetry, session or save files from benchmark runs
+    game.POSITION_SAMPLE_RATE = 0
+    game.RECORD_SESSIONS = False
+    game.SAVE_PATH = None
+    game.NPC_COUNT = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        instance = game.Game()
+
+    for npcs in npcCounts:
+        cases.append(("entities.update", {"npcs": npcs},
+                      lambda npcs=npcs: entitiesUpdate(npcs)))
+        cases.append(("drawWorld", {"npcs": npcs},
+                      lambda npcs=npcs: drawWorld(instance, npcs)))
+
+    cases.append(("itemRenderer.getImage", {},
+                 lambda: itemImages(instance)))
+    cases.append(("drawHUD", {}, lambda: drawHUD(instance)))
+
+    for count in [100, 1000]:
+        cases.append(("inventory.addItem", {"items": count},
+                      lambda count=count: addItems(count)))
+
+    results = list[dict]()
+
+    for name, params, setup in cases:
+        if args.only != None and not any(name.startswith(prefix) for prefix in args.only.split(",")):
+            continue
+
+        random.seed(SEED)
+        np.random.seed(SEED)
+
+        # setting up logs every tile it sets
+        with contextlib.redirect_stdout(io.StringIO()):
+            step = setup()
+
+        result = {"name": name, "params": params} | measure(
+            step, args.repeat, args.warmup)
+        results.append(result)
+
+        print(f"{name:24s} {json.dumps(params):52s} p50 {result['p50_ns'] / 1e3:10.1f}us "
+              f"p95 {result['p95_ns'] / 1e3:10.1f}us")
+
+    return results
+
+
+def compare(results: list[dict], baselinePath: str):
+    """Prints the p50 of every result against the same benchmark in baselinePath"""
+    with open(baselinePath) as file:
+        baseline = json.load(file)
+
+    before = {(result["name"], json.dumps(result["params"], sort_keys=True)): result
+              for result in baseline["results"]}
+
+    print(f"\ncompared with {baselinePath} ({baseline['meta'].get('commit')})")
+
+    for result in results:
+        key = (result["name"], json.dumps(result["params"], sort_keys=True))
+
+        if key not in before:
+            continue
+
+        ratio = result["p50_ns"] / max(before[key]["p50_ns"], 1)
+        print(f"{result['name']:24s} {key[1]:52s} {ratio:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times the simulation and rendering hot paths without a display")
+    parser.add_argument("--sizes", default="40x30,256x256,1000x1000",
+                        help="tile storage sizes, comma separated WIDTHxHEIGHT")
+    parser.add_argument("--crops", default="100,1000,10000",
+                        help="planted crops, comma separated")
+    parser.add_argument("--polygons", default="0,100,1000",
+                        help="extra collision polygons, comma separated")
+    parser.add_argument("--npcs", default="0,200,1000",
+                        help="wandering entities, comma separated")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", default=None,
+                        help="only run benchmarks whose names start with one of these, comma separated")
+    parser.add_argument("--output", default=None,
+                        help="write the results here as JSON")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = runAll(args)
+
+    report = {
+        "meta": {
+            "commit": gitCommit(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "pygame": pygame.version.ver,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare != None:
+        compare(results, args.compare)
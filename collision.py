@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+from shapely import geometry  # type: ignore
+
+from constants import CELL_SIZE
+
+Bounds = tuple[float, float, float, float]
+
+
+class CollisionShape:
+    """
+    A collision object tested against axis aligned boxes. Rectangles use
+    plain bounds comparisons, anything else falls back to shapely.
+    """
+
+    def __init__(self, polygon: geometry.Polygon) -> None:
+        self.polygon = polygon
+        self.bounds: Bounds = polygon.bounds
+
+        # a polygon covering its whole envelope is the envelope itself
+        self.isRect = polygon.area > 0 and len(polygon.interiors) == 0 and \
+            polygon.area == polygon.envelope.area
+
+    def intersects(self, bounds: Bounds) -> bool:
+        """Same as shapely intersects, touching edges count"""
+        if self.isRect:
+            minX, minY, maxX, maxY = self.bounds
+
+            return minX <= bounds[2] and bounds[0] <= maxX and \
+                minY <= bounds[3] and bounds[1] <= maxY
+
+        return self.polygon.intersects(geometry.box(*bounds))
+
+    def contains(self, bounds: Bounds) -> bool:
+        """Same as shapely contains for a box with a non zero area"""
+        if self.isRect:
+            minX, minY, maxX, maxY = self.bounds
+
+            return minX <= bounds[0] and bounds[2] <= maxX and \
+                minY <= bounds[1] and bounds[3] <= maxY
+
+        return self.polygon.contains(geometry.box(*bounds))
+
+
+class CollisionGrid:
+    """
+    Uniform grid over the collision shapes, bucketed by tile cell. A
+    shape is registered in every cell its bounding box touches, edges
+    included, so any shape that could touch a query box is returned.
+    """
+
+    def __init__(self, objects: list[geometry.Polygon], cellSize: int = CELL_SIZE) -> None:
+        self.objects = objects
+        self.shapes = [CollisionShape(object) for object in objects]
+        self.cellSize = cellSize
+
+        self._cells: dict[tuple[int, int], list[int]] = {}
+
+        for (index, shape) in enumerate(self.shapes):
+            for cell in self._cellsIn(shape.bounds):
+                self._cells.setdefault(cell, []).append(index)
+
+    def _cellsIn(self, bounds: Bounds):
+        minX, minY, maxX, maxY = bounds
+
+        for x in range(math.floor(minX / self.cellSize), math.floor(maxX / self.cellSize) + 1):
+            for y in range(math.floor(minY / self.cellSize), math.floor(maxY / self.cellSize) + 1):
+                yield (x, y)
+
+    def query(self, bounds: Bounds) -> list[CollisionShape]:
+        """Returns the shapes near bounds, in the same order as objects"""
+        indices = set[int]()
+
+        for cell in self._cellsIn(bounds):
+            found = self._cells.get(cell)
+
+            if found != None:
+                indices.update(found)
+
+        return [self.shapes[i] for i in sorted(indices)]
+
+
+class CollisionMask:
+    """
+    The collision shapes drawn into a pixel mask, with a summed area table
+    over it so whether a box overlaps a shape is four lookups. blocked
+    answers for any number of boxes at once, for moving many characters in
+    one vectorized pass. Every pixel a shape's bounds touch is blocked, so
+    the mask can block more than the shapes but never less: a box it finds
+    clear is clear, a blocked one is worth testing against the shapes.
+    """
+
+    def __init__(self, objects: list[geometry.Polygon], width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+
+        self.mask = np.zeros((height, width), bool)
+        for object in objects:
+            minX, minY, maxX, maxY = object.bounds
+
+            self.mask[max(math.floor(minY), 0):max(math.floor(maxY) + 1, 0),
+                      max(math.floor(minX), 0):max(math.floor(maxX) + 1, 0)] = True
+
+        # sums[y, x] is the number of blocked pixels above and left of x, y
+        self.sums = np.zeros((height + 1, width + 1), np.int32)
+        self.sums[1:, 1:] = self.mask.cumsum(
+            0, dtype=np.int32).cumsum(1, dtype=np.int32)
+
+    def blocked(self, minX: np.ndarray, minY: np.ndarray, maxX: np.ndarray, maxY: np.ndarray) -> np.ndarray:
+        """Which of the boxes touch a blocked pixel, boxes off the mask are only tested where they overlap it"""
+        x0 = np.clip(np.floor(minX).astype(np.int64), 0, self.width)
+        y0 = np.clip(np.floor(minY).astype(np.int64), 0, self.height)
+        x1 = np.clip(np.floor(maxX).astype(np.int64) + 1, 0, self.width)
+        y1 = np.clip(np.floor(maxY).astype(np.int64) + 1, 0, self.height)
+
+        sums = self.sums
+        count = sums[y1, x1] - sums[y0, x1] - sums[y1, x0] + sums[y0, x0]
+
+        return (count > 0) & (x1 > x0) & (y1 > y0)
+
+
+def centeredBounds(x: float, y: float, size: float) -> Bounds:
+    half = size / 2
+
+    return (x - half, y - half, x + half, y + half)
+
+
+def unionBounds(*boxes: Bounds) -> Bounds:
+    minX, minY, maxX, maxY = boxes[0]
+
+    for box in boxes[1:]:
+        minX = min(minX, box[0])
+        minY = min(minY, box[1])
+        maxX = max(maxX, box[2])
+        maxY = max(maxY, box[3])
+
+    return (minX, minY, maxX, maxY)
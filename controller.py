@@ -1,32 +1,92 @@
 import enum
-import time
+import heapq
+import sys
+from typing import Any, Callable, Iterator
 
+import numpy as np
 import pygame
-from pytmx import TiledObject, TiledObjectGroup, load_pygame  # type: ignore
 from shapely import geometry  # type: ignore
 from shapely.ops import nearest_points  # type: ignore
 
 import items
+from actionbus import ActionBus
+from collision import (Bounds, CollisionGrid, CollisionMask, centeredBounds,
+                       unionBounds)
 from constants import *
-from items import Item, ItemStack, Seed
+from growth import TICKS_PER_DAY, GrowthScheduler, growthStage, nextStageAt
+from items import Crop, Item, ItemStack, Seed
+from mapcache import loadMap
+from tilegrid import SPARSE_CHUNK_SIZE, SparseTileGrid, TileGrid
+from timing import Clock, SystemClock
 
 HITBOX_VEC = Vector2(CELL_SIZE /
                      2, CELL_SIZE * 1.5)
 
 CHARACTER_SPEED = 80
 ANIMATION_SPEED = 5
+ANIMATION_FRAMES = 4
+
+# same tick time as original, about seven seconds per ten minutes
+TICK_LENGTH = 7166666666
+
+MAP_PATH = "./assets/tiled/minimap.tmx"
+
+INVENTORY_ROW_SIZE = 12
+
+# coords with both parts below this are interned
+COORD_INTERN_SIZE = 256
+
+# cells a side of the chunks tiles are saved in, a save only writes again
+# the chunks changed since the last one
+SAVE_CHUNK_SIZE = SPARSE_CHUNK_SIZE
 
 
 class Coord:
+    """
+    An immutable cell position, usable as a dict or set key. Coords with
+    both parts below COORD_INTERN_SIZE are made once and shared, so asking
+    for a cell on the map again does not allocate.
+    """
+
+    __slots__ = ("x", "y")
+
     x: int
     y: int
 
-    def __init__(self, x: int, y: int) -> None:
-        self.x = x
-        self.y = y
+    def __new__(cls, x: int, y: int) -> "Coord":
+        if 0 <= x < COORD_INTERN_SIZE and 0 <= y < COORD_INTERN_SIZE:
+            column = _internedCoords[x]
+            coord = column[y]
+
+            if coord == None:
+                coord = column[y] = Coord._make(x, y)
+
+            return coord
+
+        return Coord._make(x, y)
+
+    @staticmethod
+    def _make(x: int, y: int) -> "Coord":
+        coord = object.__new__(Coord)
+        object.__setattr__(coord, "x", x)
+        object.__setattr__(coord, "y", y)
+
+        return coord
+
+    def __setattr__(self, name: str, value: object):
+        raise AttributeError("Coord is immutable")
+
+    def __reduce__(self):
+        return (Coord, (self.x, self.y))
 
     def __eq__(self, __o: object) -> bool:
-        return self.x == __o.x and self.y == __o.y  # type: ignore
+        if not isinstance(__o, Coord):
+            return NotImplemented
+
+        return self.x == __o.x and self.y == __o.y
+
+    def __hash__(self) -> int:
+        return hash((self.x, self.y))
 
     def __str__(self) -> str:
         return f"x: {self.x}, y: {self.y}"
@@ -34,54 +94,230 @@ class Coord:
     def __repr__(self) -> str:
         return self.__str__()
 
+
+# indexed [x][y], filled in as coords are asked for
+_internedCoords: list[list[Coord | None]] = [
+    [None] * COORD_INTERN_SIZE for _ in range(COORD_INTERN_SIZE)]
+
+
+class TileArea:
+    """
+    A width by height rectangle of cells with its top left at pos. A mask
+    of that shape, indexed [x, y] like the tile grid, narrows it to the
+    cells it is true at.
+    """
+
+    __slots__ = ("pos", "width", "height", "mask")
+
+    def __init__(self, pos: Coord, width: int, height: int, mask: np.ndarray | None = None) -> None:
+        if mask is not None and mask.shape != (width, height):
+            raise ValueError(f"mask must have shape {(width, height)}")
+
+        self.pos = pos
+        self.width = width
+        self.height = height
+        self.mask = mask
+
+    @staticmethod
+    def fromMask(pos: Coord, mask: np.ndarray) -> "TileArea":
+        return TileArea(pos, mask.shape[0], mask.shape[1], mask.astype(bool))
+
+    def cells(self, worldWidth: int, worldHeight: int) -> tuple[np.ndarray, np.ndarray]:
+        """Positions of the cells in the area that are inside the world, column by column"""
+        x0, y0 = max(self.pos.x, 0), max(self.pos.y, 0)
+        x1 = min(self.pos.x + self.width, worldWidth)
+        y1 = min(self.pos.y + self.height, worldHeight)
+
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(0, np.intp), np.zeros(0, np.intp)
+
+        if self.mask is None:
+            xs, ys = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1),
+                                 indexing="ij")
+            return xs.reshape(-1), ys.reshape(-1)
+
+        xs, ys = np.nonzero(self.mask[x0 - self.pos.x:x1 - self.pos.x,
+                                      y0 - self.pos.y:y1 - self.pos.y])
+
+        return xs + x0, ys + y0
+
+
 InventorySlot = Item | ItemStack | None
 
 class InventoryManager:
+    """
+    Slots in rows of INVENTORY_ROW_SIZE. Which slots hold each item id and
+    which slots of each row are free are indexed, so adding, removing and
+    counting items never scans the slots.
+    """
+
     def __init__(self, rowCount: int = 1) -> None:
-        self.items: list[InventorySlot] = [None] * (12 * rowCount)
+        self.items: list[InventorySlot] = [None] * \
+            (INVENTORY_ROW_SIZE * rowCount)
         self.slotSelection = 0
-        self.rowSelection = 0
         self.rowCount = rowCount
 
+        # item id to the slots holding it, a stackable item has one at most
+        self._slots = dict[int, list[int]]()
+        # min heap of the empty slots of each row
+        self._free = [list(range(row * INVENTORY_ROW_SIZE, (row + 1) * INVENTORY_ROW_SIZE))
+                      for row in range(rowCount)]
+
+        self._rowSelection = 0
+        self._currentItems = self.items[:INVENTORY_ROW_SIZE]
+
+    @property
+    def rowSelection(self) -> int:
+        return self._rowSelection
+
+    @rowSelection.setter
+    def rowSelection(self, row: int):
+        self._rowSelection = row
+
+        offset = row * INVENTORY_ROW_SIZE
+        self._currentItems = self.items[offset:offset + INVENTORY_ROW_SIZE]
+
+    def _set(self, index: int, slot: InventorySlot):
+        previous = self.items[index]
+        if previous != None:
+            self._slots[_slotItem(previous).id].remove(index)
+
+        self.items[index] = slot
+        if slot != None:
+            self._slots.setdefault(_slotItem(slot).id, []).append(index)
+
+        row = index // INVENTORY_ROW_SIZE
+        if row == self._rowSelection:
+            self._currentItems[index % INVENTORY_ROW_SIZE] = slot
+
+        if slot == None and previous != None:
+            heapq.heappush(self._free[row], index)
+
+    def _place(self, item: Item, count: int, index: int):
+        self._set(index, ItemStack(item, count) if item.stackable else item)
+
+    def setSlot(self, index: int, item: Item | None, count: int = 1):
+        """Replaces whatever is in slot index with count of item, or empties it when item is None"""
+        if item == None:
+            self._set(index, None)
+            return
+
+        if self.items[index] == None:
+            free = self._free[index // INVENTORY_ROW_SIZE]
+            free.remove(index)
+            heapq.heapify(free)
+
+        self._place(item, count, index)
+
     def addItem(self, item: Item, slot: int = -1):
         print("adding item")
 
         if slot == -1:  # did not specify slot, auto stack and first on row
+            self.addItems(item)
+            return
+
+        existing = self.items[slot]
+
+        if existing == None:
+            free = self._free[slot // INVENTORY_ROW_SIZE]
+            free.remove(slot)
+            heapq.heapify(free)
+
+            self._place(item, 1, slot)
+        elif isinstance(existing, ItemStack) and existing.item.id == item.id:
+            existing.add()
+
+    def addItems(self, item: Item, count: int = 1) -> int:
+        """Stacks count of item or puts them in the first free slots of the current row, returns how many fit"""
+        if count <= 0:
+            return 0
+
+        slots = self._slots.get(item.id)
+
+        if item.stackable and slots:
+            stack = self.items[slots[0]]
+            assert (isinstance(stack, ItemStack))
+
+            stack.add(count)
+            return count
+
+        free = self._free[self._rowSelection]
+        added = 0
+
+        while added < count and len(free) > 0:
+            index = heapq.heappop(free)
+
             if item.stackable:
-                for thisItem in self.items:
-                    if isinstance(thisItem, ItemStack) and thisItem.item.id == item.id:
-                        thisItem.add()
-                        return
+                self._place(item, count, index)
+                return count
+
+            self._place(item, 1, index)
+            added += 1
+
+        return added
+
+    def removeItems(self, item: Item, count: int = 1) -> int:
+        """Takes up to count of item out, emptying the slots left with none, returns how many were taken"""
+        slots = self._slots.get(item.id)
+        removed = 0
+
+        while slots and removed < count:
+            index = slots[-1]
+            slot = self.items[index]
+
+            if isinstance(slot, ItemStack):
+                taken = min(slot.count, count - removed)
+                slot.remove(taken)
+                removed += taken
+
+                if slot.count > 0:
+                    break
+            else:
+                removed += 1
+
+            self._set(index, None)
 
-            rowOffset = self.rowSelection * 12
-            for i in range(12):
-                index = i + rowOffset
+        return removed
 
-                itemSlot = self.items[index]
+    def countOf(self, item: Item) -> int:
+        total = 0
 
-                if itemSlot == None:
-                    if item.stackable:
-                        self.items[index] = ItemStack(item)
-                    else:
-                        self.items[index] = item
+        for index in self._slots.get(item.id, []):
+            slot = self.items[index]
+            total += slot.count if isinstance(slot, ItemStack) else 1
 
-                    return
+        return total
+
+    def spaceFor(self, item: Item) -> int:
+        """How many of item addItems would take right now"""
+        if item.stackable and (self._slots.get(item.id) or len(self._free[self._rowSelection]) > 0):
+            return sys.maxsize
+
+        return len(self._free[self._rowSelection])
+
+    def transfer(self, other: "InventoryManager", item: Item, count: int = 1) -> int:
+        """Moves up to count of item into other, as many as it has room for, returns how many moved"""
+        count = min(count, self.countOf(item), other.spaceFor(item))
+
+        if count <= 0:
+            return 0
+
+        return other.addItems(item, self.removeItems(item, count))
 
     @property
     def itemSelection(self) -> InventorySlot:
-        index = (self.rowSelection * 12) + self.slotSelection
+        index = (self._rowSelection * INVENTORY_ROW_SIZE) + self.slotSelection
 
         return self.items[index]
 
     @property
     def currentItems(self) -> list[InventorySlot]:
-        row = list[InventorySlot]()
-        rowOffset = self.rowSelection * 12
+        """The slots of the selected row. Kept up to date in place, so do not modify it"""
+        return self._currentItems
 
-        for i in range(12):
-            row.append(self.items[i + rowOffset])
 
-        return row
+def _slotItem(slot: Item | ItemStack) -> Item:
+    return slot.item if isinstance(slot, ItemStack) else slot
 
 
 class TileType(enum.Enum):
@@ -90,33 +326,63 @@ class TileType(enum.Enum):
 
 
 class Tile:
+    __slots__ = ("type",)
+
     def __init__(self, type: TileType) -> None:
         self.type = type
 
-    def update(self, elapsed: int):
-        """Provide the amount of time elapsed in game ticks. There are 480 game ticks in a day"""
-        pass
 
 class CropTile(Tile):
-    def __init__(self, seed: Seed) -> None:
-        self.crop = seed.plants
-        self.age = 0
-        self.epoch: int | None = None
+    __slots__ = ("crop", "plantedTick", "growth")
+
+    def __init__(self, crop: Crop) -> None:
+        self.crop = crop
+        self.plantedTick = 0
+        self.growth: GrowthScheduler | None = None
 
         super().__init__(TileType.CROP)
 
-    def update(self, elapsed: int):
-        if self.age < self.crop.matures:
-            self.age += elapsed / 480
-            
-            print(self.age)
+    @property
+    def elapsed(self) -> int:
+        """Game ticks since planting, 0 until the crop is planted in a world"""
+        if self.growth == None:
+            return 0
+
+        return self.growth.tick - self.plantedTick
+
+    @property
+    def age(self) -> float:
+        """Days since planting, capped at maturity"""
+        return min(self.elapsed / TICKS_PER_DAY, self.crop.matures)
+
+    @property
+    def stage(self) -> int:
+        return growthStage(self.crop, self.elapsed)
+
+    @property
+    def mature(self) -> bool:
+        return self.elapsed >= self.crop.matures * TICKS_PER_DAY
+
+    @property
+    def nextStageTick(self) -> int | None:
+        due = nextStageAt(self.crop, self.stage)
+
+        if due == None:
+            return None
+
+        return self.plantedTick + due
+
 
 class Action:
+    __slots__ = ()
+
     def __init__(self) -> None:
         pass
 
 
 class AddCoinsAction(Action):
+    __slots__ = ("amount",)
+
     def __init__(self, amount: int) -> None:
         super().__init__()
 
@@ -124,6 +390,8 @@ class AddCoinsAction(Action):
 
 
 class MoveCharacterAction(Action):
+    __slots__ = ("x", "y")
+
     def __init__(self, x: int, y: int) -> None:
         super().__init__()
 
@@ -136,6 +404,8 @@ class MoveCharacterAction(Action):
 
 
 class HoeGroundAction(Action):
+    __slots__ = ("pos",)
+
     def __init__(self, pos: Coord) -> None:
         super().__init__()
 
@@ -143,6 +413,8 @@ class HoeGroundAction(Action):
 
 
 class PlantSeedAction(Action):
+    __slots__ = ("pos", "seed")
+
     def __init__(self, pos: Coord, seed: Seed) -> None:
         super().__init__()
 
@@ -150,48 +422,103 @@ class PlantSeedAction(Action):
         self.seed = seed
 
 
+class HoeAreaAction(Action):
+    __slots__ = ("area",)
+
+    def __init__(self, area: TileArea) -> None:
+        super().__init__()
+
+        self.area = area
+
+
+class PlantAreaAction(Action):
+    __slots__ = ("area", "seed")
+
+    def __init__(self, area: TileArea, seed: Seed) -> None:
+        super().__init__()
+
+        self.area = area
+        self.seed = seed
+
+
+class HarvestAreaAction(Action):
+    __slots__ = ("area",)
+
+    def __init__(self, area: TileArea) -> None:
+        super().__init__()
+
+        self.area = area
+
+
 class AddItemAction(Action):
-    def __init__(self, item: Item) -> None:
+    __slots__ = ("item", "count")
+
+    def __init__(self, item: Item, count: int = 1) -> None:
         super().__init__()
 
         self.item = item
+        self.count = count
 
 
 class ChangeInventorySelectionAction(Action):
+    __slots__ = ("selection",)
+
     def __init__(self, selection: int) -> None:
         super().__init__()
 
-        if selection < 0 or selection > 11:
-            raise ValueError("must be between 0 and 11")
+        if selection < 0 or selection >= INVENTORY_ROW_SIZE:
+            raise ValueError(
+                f"must be between 0 and {INVENTORY_ROW_SIZE - 1}")
 
         self.selection = selection
 
 class IncrementDayAction(Action):
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
 
 class World:
-    def __init__(self) -> None:
-        self._tiles: list[list[Tile | None]] = [
-            [None] * int(WORLD_HEIGHT / CELL_SIZE) for _ in range(int(WORLD_WIDTH / CELL_SIZE))]
-
-        self.mapData = load_pygame("./assets/tiled/minimap.tmx")
-
-        self.collisionObjects = list[geometry.Polygon]()
-        collisionLayer: TiledObjectGroup = self.mapData.get_layer_by_name(
-            "Collision Objects")
-        for object in collisionLayer:  # type: ignore
-            assert (type(object) == TiledObject)  # type: ignore
-            self.collisionObjects.append(
-                geometry.Polygon(object.as_points))  # type: ignore
-
-        spawnPoint = self.mapData.get_object_by_name(  # type: ignore
-            "spawnPoint")
-        self.spawnPoint = Vector2(spawnPoint.x, spawnPoint.y)
-
-        self.epoch = time.time_ns()
-        self.queuedActions = list[Action]()
+    def __init__(self, clock: Clock | None = None, sparse: bool = False, size: tuple[int, int] | None = None) -> None:
+        """
+        A sparse world stores only the chunks of the map that have tiles, for
+        very large maps. size overrides the map's size in tiles for tile storage.
+        """
+        self.clock = clock or SystemClock()
+
+        # compiled from the TMX, which is only parsed when its cache is stale
+        self.map = loadMap(MAP_PATH)
+
+        tileStorage = SparseTileGrid if sparse else TileGrid
+        width, height = size or (self.map.width, self.map.height)
+        self._tiles = tileStorage(width, height)
+        self.growth = self._tiles.growth
+
+        self.collisionObjects = [geometry.Polygon(points)
+                                 for points in self.map.polygons]
+        self.collisionGrid = CollisionGrid(self.collisionObjects)
+        self._collisionMask: CollisionMask | None = None
+
+        self.spawnPoint = Vector2(self.map.spawnPoint)
+
+        # positions of the SAVE_CHUNK_SIZE chunks changed since the last save
+        self.unsavedChunks = set[tuple[int, int]]()
+
+        self.epoch = self.clock.now()
+
+        self.bus = ActionBus()
+        self.bus.registerBatch(PlantSeedAction, self.handlePlantSeedActions)
+        self.bus.registerBatch(HoeGroundAction, self.handleHoeGroundActions)
+        self.bus.register(PlantAreaAction, self.handlePlantAreaAction)
+        self.bus.register(HoeAreaAction, self.handleHoeAreaAction)
+        self.bus.register(HarvestAreaAction, self.handleHarvestAreaAction)
+        self.bus.register(ChangeInventorySelectionAction,
+                          self.handleChangeInventorySelectionAction)
+        self.bus.register(AddItemAction, self.handleAddItemAction)
+        self.bus.register(IncrementDayAction, self.handleIncrementDayAction)
+        # handled at the start of the next update
+        self.queuedActions = self.bus.queue
 
         # Global world states
         self.day = 0
@@ -201,43 +528,41 @@ class World:
         self.coins = 0
         self.inventoryManager = InventoryManager()
 
+    @property
+    def collisionMask(self) -> CollisionMask:
+        """collisionObjects drawn into a pixel mask, made the first time it is asked for"""
+        if self._collisionMask == None:
+            self._collisionMask = CollisionMask(
+                self.collisionObjects, int(WORLD_WIDTH), int(WORLD_HEIGHT))
+
+        return self._collisionMask
+
     def update(self, actions: list[Action]):
         # update time
-        now = time.time_ns()
+        now = self.clock.now()
         elapsed = now - self.epoch
-        
-        if elapsed > (7166666666): # same tick time as original, about seven seconds per ten minutes
+
+        if elapsed > TICK_LENGTH:
             self.time += 1
             self.epoch = now
 
-            for row in self._tiles:
-                for tile in row:
-                    if tile != None:
-                        tile.update(1)
+            self.growth.advance(1)
 
         # handle update actions
-        allActions = self.queuedActions + actions
-        self.queuedActions = list[Action]()
-
-        for action in allActions:
-            if isinstance(action, PlantSeedAction):
-                self.handlePlantCropAction(action)
-            elif isinstance(action, HoeGroundAction):
-                self.handleHoeGroundAction(action)
-            elif isinstance(action, ChangeInventorySelectionAction):
-                self.handleChangeInventorySelectionAction(action)
-            elif isinstance(action, AddItemAction):
-                self.handleAddItemAction(action)
-            elif isinstance(action, IncrementDayAction):
-                self.handleIncrementDayAction(action)
+        self.bus.dispatch(actions)
 
     def tileAt(self, pos: Coord):
-        return self._tiles[pos.x][pos.y]
+        return self._tiles.get(pos.x, pos.y)
 
     def setTile(self, pos: Coord, tile: Tile):
         print(f"setting {tile.type} at {pos}")
 
-        self._tiles[pos.x][pos.y] = tile
+        if isinstance(tile, CropTile):
+            self.growth.plant(tile)
+
+        self._tiles.set(pos.x, pos.y, tile)
+        self.unsavedChunks.add(
+            (pos.x // SAVE_CHUNK_SIZE, pos.y // SAVE_CHUNK_SIZE))
 
     def removeTile(self, pos: Coord):
         tile = self.tileAt(pos)
@@ -245,38 +570,116 @@ class World:
         if tile != None:
             print(f"removing {tile.type} at {pos}")
 
-        self._tiles[pos.x][pos.y] = None
+        self._tiles.clear(pos.x, pos.y)
+        self.unsavedChunks.add(
+            (pos.x // SAVE_CHUNK_SIZE, pos.y // SAVE_CHUNK_SIZE))
+
+    def handlePlantSeedActions(self, actions: list[PlantSeedAction]):
+        for seed, xs, ys in self._distinctRuns(actions, lambda action: action.seed):
+            self.plantCells(xs, ys, seed)
+
+    def handleHoeGroundActions(self, actions: list[HoeGroundAction]):
+        for _, xs, ys in self._distinctRuns(actions, lambda action: None):
+            self.hoeCells(xs, ys)
+
+    def handlePlantAreaAction(self, action: PlantAreaAction):
+        self.plantCells(*self._areaCells(action.area), action.seed)
+
+    def handleHoeAreaAction(self, action: HoeAreaAction):
+        self.hoeCells(*self._areaCells(action.area))
+
+    def handleHarvestAreaAction(self, action: HarvestAreaAction):
+        self.harvestCells(*self._areaCells(action.area))
+
+    def _areaCells(self, area: TileArea) -> tuple[np.ndarray, np.ndarray]:
+        return area.cells(self._tiles.width, self._tiles.height)
+
+    def _distinctRuns(self, actions: list, key: Callable[[Any], Any]) -> Iterator[tuple[Any, np.ndarray, np.ndarray]]:
+        """
+        Splits actions into runs sharing a key that touch every cell at most
+        once, so each run can be applied as one grid operation and still give
+        the same result as applying the actions one at a time. Cells outside
+        the world are dropped.
+        """
+        cells = set[tuple[int, int]]()
+        runKey = None
+
+        for action in actions:
+            cell = (action.pos.x, action.pos.y)
+
+            if not self._tiles.inBounds(*cell):
+                continue
+
+            if len(cells) > 0 and (cell in cells or key(action) != runKey):
+                yield runKey, *_cellArrays(cells)
+                cells = set[tuple[int, int]]()
 
-    def handlePlantCropAction(self, action: PlantSeedAction):
-        existing = self.tileAt(action.pos)
+            cells.add(cell)
+            runKey = key(action)
 
-        if existing != None and existing.type == TileType.TILLED_DIRT:
-            self.setTile(action.pos, CropTile(action.seed))
+        if len(cells) > 0:
+            yield runKey, *_cellArrays(cells)
 
-    def handleHoeGroundAction(self, action: HoeGroundAction):
-        existing = self.tileAt(action.pos)
+    def plantCells(self, xs: np.ndarray, ys: np.ndarray, seed: Seed):
+        """Plants seed in every tilled cell out of distinct cells xs, ys"""
+        tilled = self._tiles.typesAt(xs, ys) == TileType.TILLED_DIRT.value
+        xs, ys = xs[tilled], ys[tilled]
 
-        if existing != None and isinstance(existing, CropTile):
-            if existing.age >= existing.crop.matures:  # if harvesting
-                self.removeTile(action.pos)
-                self.queuedActions.append(AddItemAction(items.itemWithID(2)))
-        else:
-            self.setTile(action.pos, Tile(TileType.TILLED_DIRT))
+        self._tiles.plantMany(xs, ys, seed.plants, self.growth.tick)
+        self.cellsChanged(xs, ys)
+
+    def hoeCells(self, xs: np.ndarray, ys: np.ndarray):
+        """Tills distinct cells xs, ys, harvesting mature crops and leaving growing ones be"""
+        isCrop = self._tiles.typesAt(xs, ys) == TileType.CROP.value
+        harvest = self._harvest(xs, ys)
+
+        self._tiles.setMany(xs[~isCrop], ys[~isCrop],
+                            TileType.TILLED_DIRT.value)
+
+        changed = harvest | ~isCrop
+        self.cellsChanged(xs[changed], ys[changed])
+
+    def harvestCells(self, xs: np.ndarray, ys: np.ndarray):
+        """Picks every mature crop out of distinct cells xs, ys"""
+        harvest = self._harvest(xs, ys)
+
+        self.cellsChanged(xs[harvest], ys[harvest])
+
+    def _harvest(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Clears the mature crops among xs, ys and queues them for the inventory, returns which cells they were"""
+        harvest = self._tiles.matureAt(xs, ys, self.growth.tick)
+
+        crops, counts = np.unique(
+            self._tiles.cropsAt(xs[harvest], ys[harvest]), return_counts=True)
+        for crop, count in zip(crops.tolist(), counts.tolist()):
+            self.queuedActions.append(
+                AddItemAction(items.itemWithID(crop), count))
+
+        self._tiles.clearMany(xs[harvest], ys[harvest])
+
+        return harvest
+
+    def cellsChanged(self, xs: np.ndarray, ys: np.ndarray):
+        """Called after a bulk change to the tiles at xs, ys"""
+        if len(xs) == 0:
+            return
+
+        chunks = np.unique(np.stack(
+            [xs // SAVE_CHUNK_SIZE, ys // SAVE_CHUNK_SIZE], axis=1), axis=0)
+        self.unsavedChunks.update(
+            (cx, cy) for (cx, cy) in chunks.tolist())
 
     def handleChangeInventorySelectionAction(self, action: ChangeInventorySelectionAction):
         self.inventoryManager.slotSelection = action.selection
 
     def handleAddItemAction(self, action: AddItemAction):
-        self.inventoryManager.addItem(action.item)
+        self.inventoryManager.addItems(action.item, action.count)
 
     def handleIncrementDayAction(self, action: IncrementDayAction):
         self.day += 1
         self.time = 120
 
-        for row in self._tiles:
-            for tile in row:
-                if tile != None:
-                    tile.update(480)
+        self.growth.advance(TICKS_PER_DAY)
 
 
 class Direction(enum.Enum):
@@ -301,19 +704,27 @@ class Character(object):
 
     state: CharacterState
 
-    def __init__(self, world: World) -> None:
+    def __init__(self, world: World, clock: Clock | None = None) -> None:
         self.world = world
+        self.clock = clock or world.clock
 
-        self.pos = world.spawnPoint
+        # a copy, moving adds to pos in place
+        self.pos = Vector2(world.spawnPoint)
         self.direction = Direction.DOWN
         self.state = CharacterState.STANDING
 
-        self.epoch = time.time_ns()
+        self.epoch = self.clock.now()
         self.accumulated = 0
         self.tick = 0
 
+        # seconds elapsed during the update being handled
+        self.scale = 0.0
+
+        self.bus = ActionBus()
+        self.bus.register(MoveCharacterAction, self.__handleMoveCharacter)
+
     def update(self, actions: list[Action]):
-        now = time.time_ns()
+        now = self.clock.now()
         elapsed = now - self.epoch
 
         self.accumulated += elapsed
@@ -322,26 +733,21 @@ class Character(object):
         # if enough time has elapsed for one frame of animation, update tick
         if self.accumulated > (1e9 / ANIMATION_SPEED):
             self.accumulated -= 1e9 / ANIMATION_SPEED
-            self.tick = (self.tick + 1) % 4
+            self.tick = (self.tick + 1) % ANIMATION_FRAMES
 
         # 1e9 is the number of nanoseconds in a second
-        scale = elapsed / 1e9
-
-        newState = CharacterState.STANDING
+        self.scale = elapsed / 1e9
 
-        # handle all actions
-        for action in actions:
-            if isinstance(action, MoveCharacterAction):
-                self.__handleMoveCharacter(scale, action)
-                newState = CharacterState.WALKING
+        # handlers set the state for this update
+        self.state = CharacterState.STANDING
 
-        self.state = newState
+        self.bus.dispatch(actions)
 
     xErr, yErr = 0, 0
 
-    def __handleMoveCharacter(self, scale: float, action: MoveCharacterAction):
+    def __handleMoveCharacter(self, action: MoveCharacterAction):
         scaled = Vector2(action.x, action.y)
-        scaled.scale_to_length(CHARACTER_SPEED * scale)
+        scaled.scale_to_length(CHARACTER_SPEED * self.scale)
 
         # print(str(scaled))
 
@@ -358,20 +764,24 @@ class Character(object):
         elif vert.y > WORLD_HEIGHT - (CELL_SIZE * 2):
             scaled.y = WORLD_HEIGHT - (CELL_SIZE * 2) - self.pos.y
 
-        org = _centeredRect(self.pos + HITBOX_VEC, CELL_SIZE - 3)
-        colHorz = _centeredRect(horz + HITBOX_VEC, CELL_SIZE - 3)
-        colVert = _centeredRect(vert + HITBOX_VEC, CELL_SIZE - 3)
+        org = _hitbox(self.pos, CELL_SIZE - 3)
+        colHorz = _hitbox(horz, CELL_SIZE - 3)
+        colVert = _hitbox(vert, CELL_SIZE - 3)
 
-        for object in self.world.collisionObjects:
-            if object.intersects(colHorz) and not object.intersects(org):  # type: ignore
+        nearby = self.world.collisionGrid.query(
+            unionBounds(org, colHorz, colVert))
+
+        for object in nearby:
+            if object.intersects(colHorz) and not object.intersects(org):
                 scaled.x = 0
-            if object.intersects(colVert) and not object.intersects(org):  # type: ignore
+            if object.intersects(colVert) and not object.intersects(org):
                 scaled.y = 0
 
         self.pos += scaled
 
-        for object in self.world.collisionObjects:
-            if object.contains(_centeredRect(self.pos + HITBOX_VEC, CELL_SIZE)):  # type: ignore
+        hitbox = _hitbox(self.pos, CELL_SIZE)
+        for object in self.world.collisionGrid.query(hitbox):
+            if object.contains(hitbox):
                 print("clipping")
 
         newDir = self.direction
@@ -392,15 +802,11 @@ class Character(object):
         return Coord(int(pos.x / CELL_SIZE), int(pos.y / CELL_SIZE))
 
 
-def _centeredRect(point: pygame.math.Vector2, size: float) -> geometry.Polygon:
-    diag = Vector2(size / 2, size / 2)
-
-    topLeft = point - diag
-    bottomRight = point + diag
+def _cellArrays(cells: set[tuple[int, int]]) -> tuple[np.ndarray, np.ndarray]:
+    xs, ys = zip(*cells)
 
-    diag.y = -(size / 2)
+    return np.array(xs, np.intp), np.array(ys, np.intp)
 
-    bottomLeft = point - diag
-    topRight = point + diag
 
-    return geometry.Polygon([topLeft, bottomLeft, bottomRight, topRight])
+def _hitbox(pos: pygame.math.Vector2, size: float) -> Bounds:
+    return centeredBounds(pos.x + HITBOX_VEC.x, pos.y + HITBOX_VEC.y, size)
@@ -0,0 +1,220 @@
+import numpy as np
+
+from collision import unionBounds
+from constants import *
+from controller import (ANIMATION_FRAMES, ANIMATION_SPEED, CHARACTER_SPEED,
+                        HITBOX_VEC, CharacterState, Direction, World)
+from timing import Clock
+
+# seconds a wandering entity keeps to one heading, at least and at most
+WANDER_SECONDS = (0.5, 3.0)
+# chance a new heading is to stand still
+IDLE_CHANCE = 0.3
+# entities the arrays have room for before they grow
+ENTITY_CAPACITY = 64
+
+# every heading a wanderer can pick, standing still first
+HEADINGS = np.array([(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1),
+                     (1, 1), (1, -1), (-1, 1), (-1, -1)], np.int8)
+
+
+class EntityManager:
+    """
+    Many wandering characters updated together. Positions, headings and
+    animation state are arrays indexed by entity, moved in one vectorized
+    pass a frame on one clock and epoch for all of them. Only the entities
+    the world's collision mask finds near a shape are checked against the
+    shapes one by one. Movement follows Character: the same speed, bounds,
+    hitboxes and per axis blocking.
+    """
+
+    def __init__(self, world: World, clock: Clock | None = None, seed: int | None = None) -> None:
+        self.world = world
+        self.clock = clock or world.clock
+        self.random = np.random.default_rng(seed)
+
+        self.count = 0
+        self.pos: np.ndarray
+        self.heading: np.ndarray
+        self.direction: np.ndarray
+        self.state: np.ndarray
+        self.tick: np.ndarray
+        self.accumulated: np.ndarray
+        self.turnAt: np.ndarray
+        self._allocate(ENTITY_CAPACITY)
+
+        self.epoch = self.clock.now()
+
+    def _allocate(self, capacity: int):
+        """Makes every per entity array capacity long, keeping the entities there are"""
+        def grow(name: str, shape: tuple, dtype, fill=0):
+            array = np.full(shape, fill, dtype)
+            if self.count > 0:
+                array[:self.count] = getattr(self, name)[:self.count]
+
+            setattr(self, name, array)
+
+        self.capacity = capacity
+
+        grow("pos", (capacity, 2), np.float64)
+        # the x and y of the MoveCharacterAction each entity is following
+        grow("heading", (capacity, 2), np.int8)
+        grow("direction", (capacity,), np.uint8, Direction.DOWN.value)
+        grow("state", (capacity,), np.uint8, CharacterState.STANDING.value)
+        grow("tick", (capacity,), np.uint8)
+        grow("accumulated", (capacity,), np.int64)
+        # clock time each entity picks a new heading at
+        grow("turnAt", (capacity,), np.int64)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def spawn(self, x: float, y: float) -> int:
+        """Adds a standing entity at x, y, returns its index"""
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+
+        index = self.count
+        self.count += 1
+
+        self.pos[index] = (x, y)
+        self.heading[index] = (0, 0)
+        self.direction[index] = Direction.DOWN.value
+        self.state[index] = CharacterState.STANDING.value
+        self.tick[index] = 0
+        self.accumulated[index] = 0
+        self.turnAt[index] = self.clock.now()
+
+        return index
+
+    def spawnRandom(self, count: int):
+        """Spawns count entities at random places in the world clear of collision shapes"""
+        if count <= 0:
+            return
+
+        mask = self.world.collisionMask
+        spawned = 0
+
+        while spawned < count:
+            xs = self.random.uniform(0, WORLD_WIDTH - CELL_SIZE, count)
+            ys = self.random.uniform(0, WORLD_HEIGHT - (CELL_SIZE * 2), count)
+
+            clear = ~mask.blocked(*_hitboxes(xs, ys, CELL_SIZE))
+
+            for (x, y) in zip(xs[clear].tolist(), ys[clear].tolist()):
+                if spawned == count:
+                    break
+
+                self.spawn(x, y)
+                spawned += 1
+
+    def update(self):
+        n = self.count
+        now = self.clock.now()
+        elapsed = now - self.epoch
+        self.epoch = now
+
+        if n == 0:
+            return
+
+        pos = self.pos[:n]
+        heading = self.heading[:n]
+
+        # animation, as in Character.update
+        frameLength = int(1e9 / ANIMATION_SPEED)
+        accumulated = self.accumulated[:n]
+        accumulated += elapsed
+        animate = accumulated > frameLength
+        accumulated[animate] -= frameLength
+        self.tick[:n][animate] = (self.tick[:n][animate] + 1) % ANIMATION_FRAMES
+
+        self._wander(now)
+
+        moving = np.any(heading != 0, axis=1)
+        scaled = heading.astype(np.float64)
+        lengths = np.hypot(scaled[:, 0], scaled[:, 1])
+        scaled[moving] *= (CHARACTER_SPEED * (elapsed / 1e9)) / \
+            lengths[moving, None]
+
+        horzX = pos[:, 0] + scaled[:, 0]
+        vertY = pos[:, 1] + scaled[:, 1]
+
+        right, bottom = WORLD_WIDTH - CELL_SIZE, WORLD_HEIGHT - (CELL_SIZE * 2)
+        scaled[:, 0] = np.where(horzX < 0, -pos[:, 0],
+                                np.where(horzX > right, right - pos[:, 0], scaled[:, 0]))
+        scaled[:, 1] = np.where(vertY < 0, -pos[:, 1],
+                                np.where(vertY > bottom, bottom - pos[:, 1], scaled[:, 1]))
+
+        # the mask finds the few entities near a shape, those are tested
+        # against the shapes the grid returns for them exactly like
+        # Character does: an axis is blocked when stepping along it runs into
+        # a shape the entity was not already touching
+        size = CELL_SIZE - 3
+        org = _hitboxes(pos[:, 0], pos[:, 1], size)
+        horz = _hitboxes(horzX, pos[:, 1], size)
+        vert = _hitboxes(pos[:, 0], vertY, size)
+
+        near = self.world.collisionMask.blocked(
+            np.minimum(org[0], horz[0]) - 1, np.minimum(org[1], vert[1]) - 1,
+            np.maximum(org[2], horz[2]) + 1, np.maximum(org[3], vert[3]) + 1)
+        near &= moving
+
+        blockedX = np.zeros(n, bool)
+        blockedY = np.zeros(n, bool)
+        grid = self.world.collisionGrid
+
+        for i in np.flatnonzero(near).tolist():
+            orgBox = (org[0][i], org[1][i], org[2][i], org[3][i])
+            horzBox = (horz[0][i], horz[1][i], horz[2][i], horz[3][i])
+            vertBox = (vert[0][i], vert[1][i], vert[2][i], vert[3][i])
+
+            for object in grid.query(unionBounds(orgBox, horzBox, vertBox)):
+                if object.intersects(horzBox) and not object.intersects(orgBox):
+                    blockedX[i] = True
+                if object.intersects(vertBox) and not object.intersects(orgBox):
+                    blockedY[i] = True
+
+        scaled[blockedX, 0] = 0
+        scaled[blockedY, 1] = 0
+        pos += scaled
+
+        # stuck on both axes, so pick another heading next update
+        self.turnAt[:n][moving & blockedX & blockedY] = now
+
+        direction = self.direction[:n]
+        direction[heading[:, 1] != 0] = 1 - heading[heading[:, 1] != 0, 1]
+        direction[heading[:, 0] != 0] = 2 - heading[heading[:, 0] != 0, 0]
+
+        self.state[:n] = np.where(
+            moving, CharacterState.WALKING.value, CharacterState.STANDING.value)
+
+    def _wander(self, now: int):
+        """Gives every entity whose turn is due a new random heading and turn time"""
+        turning = np.flatnonzero(self.turnAt[:self.count] <= now)
+
+        if len(turning) == 0:
+            return
+
+        picks = self.random.integers(1, len(HEADINGS), len(turning))
+        picks[self.random.random(len(turning)) < IDLE_CHANCE] = 0
+
+        self.heading[turning] = HEADINGS[picks]
+        self.turnAt[turning] = now + \
+            (self.random.uniform(*WANDER_SECONDS, len(turning)) * 1e9).astype(np.int64)
+
+    def visibleIn(self, left: float, top: float, right: float, bottom: float) -> np.ndarray:
+        """Indices of the entities whose sprite overlaps the box, back to front"""
+        xs, ys = self.pos[:self.count, 0], self.pos[:self.count, 1]
+
+        visible = np.flatnonzero((xs + CELL_SIZE > left) & (xs < right) &
+                                 (ys + (CELL_SIZE * 2) > top) & (ys < bottom))
+
+        return visible[np.argsort(ys[visible], kind="stable")]
+
+
+def _hitboxes(xs: np.ndarray, ys: np.ndarray, size: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """The hitbox of a character at every xs, ys, as in controller._hitbox"""
+    centerX, centerY = xs + HITBOX_VEC.x, ys + HITBOX_VEC.y
+    half = size / 2
+
+    return (centerX - half, centerY - half, centerX + half, centerY + half)
@@ -1,20 +1,32 @@
 import datetime
+import enum
 import os
+import struct
 import time
-from typing import Dict
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict
 
+import numpy as np
 import pygame
 from pygame import Rect, Surface
-from pytmx import TiledTileLayer  # type: ignore
 
 import color
 import items
+from actionlog import ActionRecorder
 from constants import *
-from controller import (Action, ChangeInventorySelectionAction, Character,
-                        CharacterState, Coord, CropTile, HoeGroundAction,
-                        IncrementDayAction, ItemStack, MoveCharacterAction,
-                        PlantSeedAction, Tile, TileType, World)
+from controller import (ANIMATION_FRAMES, INVENTORY_ROW_SIZE, Action,
+                        ChangeInventorySelectionAction, Character,
+                        CharacterState, Coord, CropTile, Direction,
+                        HoeGroundAction, IncrementDayAction, ItemStack,
+                        MoveCharacterAction, PlantSeedAction, Tile, World)
+from entities import EntityManager
 from items import Item, ItemType, Seed
+from profiler import FrameProfiler
+from savegame import SaveWriter, loadGame
+from telemetry import PositionTelemetry
+from timing import Clock, FrameClock
 
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
@@ -25,6 +37,62 @@ INVENTORY_KEYS = [
     pygame.K_9, pygame.K_0, pygame.K_MINUS, pygame.K_EQUALS
 ]
 
+# past this many dirty cells in one chunk baking it again is cheaper
+OVERLAY_REBUILD_THRESHOLD = 64
+
+# world surfaces are baked in chunks of this many tiles a side
+CHUNK_TILES = 16
+CHUNK_PIXELS = CHUNK_TILES * CELL_SIZE
+# chunks kept per layer before the least recently used is dropped
+CHUNK_BUDGET = 32
+
+# item sprites kept by ItemRenderer before the least recently used is dropped
+ITEM_CACHE_SIZE = 64
+
+# one camera position out of this many frames is written to ./debug, 0 disables it
+POSITION_SAMPLE_RATE = 1
+
+# write the actions of every frame to ./debug, to replay with actionlog.py
+RECORD_SESSIONS = False
+
+# wandering characters spawned at random when the game starts, none by
+# default as the only tileset for them is the player's own
+NPC_COUNT = 0
+NPC_TILESET = "./assets/penny.png"
+
+# the game is loaded from and saved to this file, None disables saving
+SAVE_PATH: str | None = "./saves/farm.save"
+# world ticks between autosaves, an in-game hour
+AUTOSAVE_TICKS = 20
+
+
+# stages Game.run times every frame, nested ones are timed inside their parent
+PROFILE_STAGES = ["captureInputs", "processInputs", "update", "world.update", "entities.update",
+                  "render", "drawWorld", "drawHUD", "present", "scale", "display.update", "tick"]
+# frames of stage times kept for percentiles and export
+PROFILE_HISTORY = 600
+# frame time graph toggled with F3, one column a frame
+PROFILE_GRAPH_SIZE = (120, 40)
+# frames between refreshes of the percentile text
+PROFILE_TEXT_INTERVAL = 30
+
+
+class Presentation(enum.Enum):
+    # scale the frame to the whole window, at any ratio
+    STRETCH = 0
+    # scale by the largest whole factor that fits, centered with black bars
+    INTEGER = 1
+
+
+PRESENTATION = Presentation.INTEGER
+
+# inventory bar layout
+INVENTORY_CELL_SIZE = CELL_SIZE + 2
+INVENTORY_SLOT_SIZE = INVENTORY_CELL_SIZE + 1
+INVENTORY_BAR_WIDTH = INVENTORY_ROW_SIZE * INVENTORY_SLOT_SIZE
+INVENTORY_X = int((DISPLAY_WIDTH - INVENTORY_BAR_WIDTH) / 2)
+INVENTORY_Y_OFFSET = 25
+
 
 class InputStack:
     def __init__(self) -> None:
@@ -103,6 +171,24 @@ class InputStack:
         return highest
 
 
+class CachedText:
+    """A text surface that is only rendered again when its string changes"""
+
+    def __init__(self, font: pygame.font.Font, textColor: tuple[int, int, int]) -> None:
+        self.font = font
+        self.color = textColor
+
+        self.text: str | None = None
+        self.surface: Surface | None = None
+
+    def render(self, text: str) -> Surface:
+        if self.surface == None or text != self.text:
+            self.surface = self.font.render(text, False, self.color)
+            self.text = text
+
+        return self.surface
+
+
 class ItemRenderer():
     def __init__(self) -> None:
         self.toolsTileSet = pygame.image.load(
@@ -112,7 +198,41 @@ class ItemRenderer():
 
         self.defaultFont = pygame.font.Font("./assets/font.ttf", 8)
 
-    def getImage(self, item: Item | ItemStack):
+        self.cacheSize = ITEM_CACHE_SIZE
+        # keyed by item id and stack count, -1 for items that are not stacks
+        self._cache: OrderedDict[tuple[int, int], Surface] = OrderedDict()
+
+    def getImage(self, item: Item | ItemStack) -> Surface:
+        """The returned surface is shared, blit it rather than drawing on it"""
+        if isinstance(item, ItemStack):
+            key = (item.item.id, item.count)
+        else:
+            key = (item.id, -1)
+
+        image = self._cache.get(key)
+
+        if image != None:
+            self._cache.move_to_end(key)
+            return image
+
+        image = self._renderImage(item)
+        self._cache[key] = image
+
+        if len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+        return image
+
+    def invalidate(self, itemID: int | None = None):
+        """Drops the cached sprites of one item, or of every item"""
+        if itemID == None:
+            self._cache.clear()
+            return
+
+        for key in [key for key in self._cache if key[0] == itemID]:
+            del self._cache[key]
+
+    def _renderImage(self, item: Item | ItemStack) -> Surface:
         image = pygame.Surface((CELL_SIZE + 2, CELL_SIZE + 2), pygame.SRCALPHA)
 
         spriteItem = item
@@ -155,96 +275,371 @@ class ItemRenderer():
         return image
 
 
+class CharacterSprites:
+    """
+    Every animation frame of a character tile set, sliced once and shared
+    by all the characters drawn with it. table holds the same frames
+    indexed [state][direction][tick] by enum value, for drawing from arrays.
+    """
+
+    _loaded: Dict[str, "CharacterSprites"] = {}
+
+    def __init__(self, tileSet: str) -> None:
+        self.tileSet = pygame.image.load(tileSet).convert()
+
+        # keyed by (state, direction, tick)
+        self.frames: Dict[tuple[CharacterState, Direction, int], Surface] = {}
+        for state in CharacterState:
+            for direction in Direction:
+                for tick in range(ANIMATION_FRAMES):
+                    self.frames[(state, direction, tick)] = self._sliceFrame(
+                        state, direction, tick)
+
+        self.table = [[[self.frames[(state, direction, tick)] for tick in range(ANIMATION_FRAMES)]
+                       for direction in Direction] for state in CharacterState]
+
+    @staticmethod
+    def load(tileSet: str) -> "CharacterSprites":
+        """The sprites of tileSet, sliced the first time they are asked for"""
+        if tileSet not in CharacterSprites._loaded:
+            CharacterSprites._loaded[tileSet] = CharacterSprites(tileSet)
+
+        return CharacterSprites._loaded[tileSet]
+
+    def _sliceFrame(self, state: CharacterState, direction: Direction, tick: int) -> Surface:
+        row = 0
+        col = tick
+
+        if state == CharacterState.STANDING:
+            row = int(direction.value)
+            col = 0
+        elif state == CharacterState.WALKING:
+            row = int(direction.value)
+
+        image = Surface((CELL_SIZE, CELL_SIZE * 2)).convert()
+        image.blit(self.tileSet, (0, 0), Rect(
+            (col * CELL_SIZE) + 21, (row * CELL_SIZE * 2) + 46, CELL_SIZE, CELL_SIZE * 2))
+        image.set_colorkey(color.MAGENTA, pygame.RLEACCEL)
+
+        return image
+
+
 class DrawableCharacter(Character):
     def __init__(self, identifier: str, tileSet: str, world: World) -> None:
         super().__init__(world)
 
         self.identifier = identifier
-        self.tileSet = pygame.image.load(tileSet).convert()
+        self.frames = CharacterSprites.load(tileSet).frames
 
         self.tick = 0
         self.accumulated = 0
 
     def image(self) -> Surface:
-        row = 0
-        col = self.tick
+        return self.frames[(self.state, self.direction, self.tick)]
 
-        if self.state == CharacterState.STANDING:
-            row = int(self.direction.value)
-            col = 0
-        elif self.state == CharacterState.WALKING:
-            row = int(self.direction.value)
 
-        image = Surface((CELL_SIZE, CELL_SIZE * 2))
-        image.blit(self.tileSet, (0, 0), Rect(
-            (col * CELL_SIZE) + 21, (row * CELL_SIZE * 2) + 46, CELL_SIZE, CELL_SIZE * 2))
-        image.set_colorkey(color.MAGENTA)
+class ChunkCache:
+    """
+    Surfaces for fixed size chunks of the world, keyed by chunk position.
+    A chunk is baked the first time it is asked for, and past budget the
+    least recently used chunk is dropped to be baked again later. bake may
+    return None for a chunk with nothing to draw.
+    """
 
-        return image
+    def __init__(self, bake: Callable[[int, int], Surface | None], budget: int = CHUNK_BUDGET) -> None:
+        self.bake = bake
+        self.budget = budget
 
+        self.chunks: OrderedDict[tuple[int, int], Surface | None] = OrderedDict()
 
-class DrawableWorld(World):
-    def __init__(self) -> None:
-        super().__init__()
+    def get(self, cx: int, cy: int) -> Surface | None:
+        key = (cx, cy)
+
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        chunk = self.bake(cx, cy)
+        self.chunks[key] = chunk
 
-        self.image = pygame.Surface((WORLD_WIDTH, WORLD_HEIGHT))
+        if len(self.chunks) > self.budget:
+            self.chunks.popitem(last=False)
 
-        for layer in self.mapData.layers:  # type: ignore
-            if isinstance(layer, TiledTileLayer):
-                for x, y, image in layer.tiles():  # type: ignore
-                    if isinstance(image, pygame.Surface):
-                        self.image.blit(image, (x * CELL_SIZE, y * CELL_SIZE))
+        return chunk
+
+    def drop(self, cx: int, cy: int):
+        self.chunks.pop((cx, cy), None)
+
+    def clear(self):
+        self.chunks.clear()
+
+
+class DrawableWorld(World):
+    def __init__(self, clock: Clock | None = None, sparse: bool = False, size: tuple[int, int] | None = None) -> None:
+        super().__init__(clock, sparse, size)
+
+        # every tile layer of the map, drawn from the map cache
+        self.layerImage = self.map.image()
 
         self.dirtTileSet = pygame.image.load(
             "./assets/hoed.png", "hoed dirt")
         self.cropsTileSet = pygame.image.load(
             "./assets/crops.png", "crops")
 
-        self.overlayImage = pygame.Surface(
-            (WORLD_WIDTH, WORLD_HEIGHT), pygame.SRCALPHA, 32)
+        # tilled dirt and crops, baked per chunk from the tiles
+        self.overlayChunks = ChunkCache(self._bakeOverlay)
+        # area of each overlay chunk anything has been drawn on
+        self.overlayBounds: Dict[tuple[int, int], Rect] = {}
+        # chunks whose overlay changed since a compositor last looked
+        self.changedChunks = set[tuple[int, int]]()
+        # bumped whenever every overlay chunk is rebuilt
+        self.overlayGeneration = 0
+
+        # cells whose overlay needs to be redrawn before the next frame
+        self._dirtyCells = set[tuple[int, int]]()
+        # number of overlay cells redrawn during the last frame
+        self.redrawnCells = 0
+
+        # only crops whose sprite frame moved need to be redrawn
+        self.growth.listeners.append(self._onGrowthStage)
+
+    def update(self, actions: list[Action]):
+        super().update(actions)
+
+        self.renderDirty()
+
+    def markDirty(self, pos: Coord):
+        self._dirtyCells.add((pos.x, pos.y))
+
+    def _onGrowthStage(self, x: int, y: int, tile: CropTile):
+        self._dirtyCells.add((x, y))
+
+    def cellsChanged(self, xs: np.ndarray, ys: np.ndarray):
+        super().cellsChanged(xs, ys)
+
+        self._dirtyCells.update(zip(xs.tolist(), ys.tolist()))
 
     def renderWorld(self):
-        self.overlayImage = pygame.Surface(
-            (WORLD_WIDTH, WORLD_HEIGHT), pygame.SRCALPHA, 32)
+        """Rebuilds the whole overlay, use renderDirty for per cell changes"""
+        self.overlayChunks.clear()
+        self._dirtyCells.clear()
+        self.overlayGeneration += 1
+
+    def renderDirty(self):
+        dirty = self._dirtyCells
+        self.redrawnCells = 0
+
+        if len(dirty) == 0:
+            return
+
+        self._dirtyCells = set[tuple[int, int]]()
+
+        # crops are two cells tall, so a cell change also touches the
+        # sprite of the crop below it and the cell above it
+        byChunk = dict[tuple[int, int], list[tuple[int, int]]]()
+        for (x, y) in dirty:
+            for key in {_chunkOf(x, y - 1), _chunkOf(x, y)}:
+                byChunk.setdefault(key, []).append((x, y))
+
+        for key, cells in byChunk.items():
+            self.changedChunks.add(key)
+
+            if key not in self.overlayChunks.chunks:
+                continue  # baked from scratch once it is in view
+
+            chunk = self.overlayChunks.chunks[key]
+
+            # an empty chunk has nothing to redraw into, and past the
+            # threshold baking the chunk again is cheaper than cell by cell
+            if chunk == None or len(cells) > OVERLAY_REBUILD_THRESHOLD:
+                self.overlayChunks.drop(*key)
+                continue
+
+            offsetX, offsetY = key[0] * CHUNK_PIXELS, key[1] * CHUNK_PIXELS
+
+            for (x, y) in cells:
+                local = Rect((x * CELL_SIZE) - offsetX, ((y - 1) * CELL_SIZE) - offsetY,
+                             CELL_SIZE, CELL_SIZE * 2)
+
+                chunk.set_clip(local)
+                chunk.fill((0, 0, 0, 0), local)
 
-        for (i, row) in enumerate(self._tiles):
-            for (j, tile) in enumerate(row):
-                pos = Coord(i, j)
-                if tile != None:
-                    if tile.type == TileType.TILLED_DIRT:
-                        self.overlayImage.blit(self.dirtTileSet, (pos.x * CELL_SIZE,
-                                                                  pos.y * CELL_SIZE), Rect(0, 0, CELL_SIZE, CELL_SIZE))
-                    elif isinstance(tile, CropTile):
-                        self.overlayImage.blit(self.dirtTileSet, (pos.x * CELL_SIZE,
-                                                                  pos.y * CELL_SIZE), Rect(0, 0, CELL_SIZE, CELL_SIZE))
+                for j in range(y - 1, y + 2):
+                    self._renderTile(chunk, x, j, offsetX, offsetY)
 
-                        renderPos = tile.crop.renderPos.split(":")
-                        intPos = int(renderPos[0])
-                        posCounts = int(renderPos[2])
+                self.overlayBounds[key].union_ip(local.clip(chunk.get_rect()))
 
-                        renderX = (
-                            (intPos % 2) * 8) + round(((posCounts - 1) * tile.age) / tile.crop.matures)
-                        renderY = intPos / 2
+            chunk.set_clip(None)
 
-                        print(tile.age)
+        self.redrawnCells += len(dirty)
 
-                        self.overlayImage.blit(self.cropsTileSet, (pos.x * CELL_SIZE,
-                                                                   (pos.y - 1) * CELL_SIZE), Rect(renderX * CELL_SIZE, renderY * 2 * CELL_SIZE, CELL_SIZE, CELL_SIZE * 2))
+    def _bakeOverlay(self, cx: int, cy: int) -> Surface | None:
+        x0, y0 = cx * CHUNK_TILES, cy * CHUNK_TILES
+
+        # the row below the chunk holds crops reaching up into it
+        cells = self._tiles.populatedIn(
+            x0, y0, x0 + CHUNK_TILES, y0 + CHUNK_TILES + 1)
+
+        if len(cells) == 0:
+            return None
+
+        chunk = pygame.Surface(
+            (CHUNK_PIXELS, CHUNK_PIXELS), pygame.SRCALPHA, 32).convert_alpha()
+        offsetX, offsetY = x0 * CELL_SIZE, y0 * CELL_SIZE
+
+        bounds = None
+        for (x, y) in cells:
+            self._renderTile(chunk, x, y, offsetX, offsetY)
+
+            drawn = Rect((x * CELL_SIZE) - offsetX, ((y - 1) * CELL_SIZE) - offsetY,
+                         CELL_SIZE, CELL_SIZE * 2)
+            bounds = drawn if bounds == None else bounds.union(drawn)
+
+        self.overlayBounds[(cx, cy)] = bounds.clip(chunk.get_rect())  # type: ignore
+        self.redrawnCells += len(cells)
+
+        return chunk
+
+    def _renderTile(self, target: Surface, x: int, y: int, offsetX: int, offsetY: int):
+        if not self._tiles.inBounds(x, y):
+            return
+
+        tile = self._tiles.get(x, y)
+
+        if tile == None:
+            return
+
+        left = (x * CELL_SIZE) - offsetX
+        top = (y * CELL_SIZE) - offsetY
+
+        target.blit(self.dirtTileSet, (left, top),
+                    Rect(0, 0, CELL_SIZE, CELL_SIZE))
+
+        if isinstance(tile, CropTile):
+            renderX, renderY = _cropFrame(tile)
+
+            target.blit(self.cropsTileSet, (left, top - CELL_SIZE), Rect(renderX *
+                        CELL_SIZE, renderY * 2 * CELL_SIZE, CELL_SIZE, CELL_SIZE * 2))
+
+    def bakeBase(self, cx: int, cy: int, background: Surface) -> Surface:
+        """The map tile layers of one chunk drawn over background"""
+        x0, y0 = cx * CHUNK_TILES, cy * CHUNK_TILES
+        offsetX, offsetY = x0 * CELL_SIZE, y0 * CELL_SIZE
+
+        chunk = Surface((CHUNK_PIXELS, CHUNK_PIXELS)).convert()
+        chunk.fill(color.BLACK)
+        chunk.blit(background, (-offsetX, -offsetY))
+
+        chunk.blit(self.layerImage, (0, 0), Rect(
+            offsetX, offsetY, CHUNK_PIXELS, CHUNK_PIXELS))
+
+        return chunk
 
     def setTile(self, pos: Coord, tile: Tile):
         super().setTile(pos, tile)
 
-        self.renderWorld()
+        self.markDirty(pos)
 
     def removeTile(self, pos: Coord):
         super().removeTile(pos)
 
-        self.renderWorld()
+        self.markDirty(pos)
+
+
+def _cropFrame(tile: CropTile) -> tuple[float, float]:
+    intPos = int(tile.crop.renderPos.split(":")[0])
+
+    renderX = ((intPos % 2) * 8) + tile.stage
+    renderY = intPos / 2
+
+    return renderX, renderY
+
+
+def _chunkOf(x: int, y: int) -> tuple[int, int]:
+    return (x // CHUNK_TILES, y // CHUNK_TILES)
+
+
+class WorldCompositor:
+    """
+    Draws the world into a frame. Chunks of the background and map layers
+    are baked together in the display format when they first come into
+    view. The chunks around the view are composited with their overlay into
+    a window surface, which is only touched again when the view crosses
+    into other chunks or an overlay chunk changes, so a frame is one blit.
+    """
+
+    def __init__(self, world: DrawableWorld, background: Surface) -> None:
+        self.world = world
+        self.background = background
+        self.bounds = Rect(0, 0, WORLD_WIDTH, WORLD_HEIGHT)
+
+        self.columns = -(-WORLD_WIDTH // CHUNK_PIXELS)
+        self.rows = -(-WORLD_HEIGHT // CHUNK_PIXELS)
+
+        self.baseChunks = ChunkCache(
+            lambda cx, cy: world.bakeBase(cx, cy, background))
+
+        # enough chunks to cover a view at any offset
+        self.windowColumns = ((int(DISPLAY_WIDTH) - 1) // CHUNK_PIXELS) + 2
+        self.windowRows = ((int(DISPLAY_HEIGHT) - 1) // CHUNK_PIXELS) + 2
+        self.window = Surface((self.windowColumns * CHUNK_PIXELS,
+                               self.windowRows * CHUNK_PIXELS)).convert()
+
+        self.windowOrigin: tuple[int, int] | None = None
+        self.generation = -1
+
+    def draw(self, target: Surface, view: Rect):
+        origin = (max(view.left // CHUNK_PIXELS, 0),
+                  max(view.top // CHUNK_PIXELS, 0))
+
+        if origin != self.windowOrigin or self.generation != self.world.overlayGeneration:
+            self.windowOrigin = origin
+            self.generation = self.world.overlayGeneration
+
+            self.window.fill(color.BLACK)
+            for cy in range(origin[1], origin[1] + self.windowRows):
+                for cx in range(origin[0], origin[0] + self.windowColumns):
+                    self._compose(cx, cy)
+        else:
+            for (cx, cy) in self.world.changedChunks:
+                self._compose(cx, cy)
+
+        self.world.changedChunks.clear()
+
+        # only a view hanging off the world shows the black behind it
+        if not self.bounds.contains(view):
+            target.fill(color.BLACK)
+
+        target.blit(self.window, (0, 0), view.move(-origin[0] *
+                    CHUNK_PIXELS, -origin[1] * CHUNK_PIXELS))
+
+    def _compose(self, cx: int, cy: int):
+        assert (self.windowOrigin != None)
+
+        column, row = cx - self.windowOrigin[0], cy - self.windowOrigin[1]
+
+        if not (0 <= column < self.windowColumns and 0 <= row < self.windowRows):
+            return
+        if not (0 <= cx < self.columns and 0 <= cy < self.rows):
+            return
+
+        dest = (column * CHUNK_PIXELS, row * CHUNK_PIXELS)
+
+        self.window.blit(self.baseChunks.get(cx, cy), dest)  # type: ignore
 
-    def handleIncrementDayAction(self, action: IncrementDayAction):
-        super().handleIncrementDayAction(action)
+        overlay = self.world.overlayChunks.get(cx, cy)
+        if overlay != None:
+            drawn = self.world.overlayBounds[(cx, cy)]
+            self.window.blit(overlay, (dest[0] + drawn.x,
+                             dest[1] + drawn.y), drawn)
 
-        self.renderWorld()
+
+def _reportSave(future: "Future[None]"):
+    """Prints why a save failed, if it did"""
+    error = future.exception()
+
+    if error != None:
+        print(f"saving failed: {error!r}")
 
 
 class Game:
@@ -262,30 +657,98 @@ class Game:
             self.defaultFonts.append(
                 pygame.font.Font("./assets/font.ttf", i))
 
+        self.fpsText = CachedText(self.defaultFonts[16], color.GREEN)
+        self.clockText = CachedText(
+            self.defaultFonts[16], color.RED4)  # type: ignore
+
+        # slot numbers never change, so they are drawn into the bar once
+        self.slotLabels = [self.defaultFonts[8].render(
+            str(i), False, color.BLACK) for i in range(INVENTORY_ROW_SIZE)]
+        self.inventoryBar = Surface(
+            (INVENTORY_BAR_WIDTH, INVENTORY_CELL_SIZE))
+        self.inventoryBar.fill(color.ORANGE2)
+        for (i, label) in enumerate(self.slotLabels):
+            self.inventoryBar.blit(label, (i * INVENTORY_SLOT_SIZE, 0))
+
         self.inputs = InputStack()
         self.inputs.append(pygame.K_1)
 
-        self.world = DrawableWorld()
+        # read once a frame, so the world and player see the same time
+        self.frameClock = FrameClock()
+
+        self.world = DrawableWorld(self.frameClock)
         self.player = DrawableCharacter(
             "player", "./assets/penny.png", self.world)
         self.itemRenderer = ItemRenderer()
+
+        self.entities = EntityManager(self.world)
+        self.entities.spawnRandom(NPC_COUNT)
+        self.npcSprites = CharacterSprites.load(NPC_TILESET)
+        self.compositor = WorldCompositor(self.world, self.background)
         self.actions = list[Action]()
 
-        # TODO Temporary select an item for testing
-        self.world.inventoryManager.addItem(items.itemWithID(0))
-        self.world.inventoryManager.addItem(items.itemWithID(1))
+        self.saves: SaveWriter | None = None
+        if SAVE_PATH != None:
+            self.saves = SaveWriter(SAVE_PATH)
+
+        if SAVE_PATH != None and self.loadSave(SAVE_PATH):
+            self.world.renderWorld()
+        else:
+            # TODO Temporary select an item for testing
+            self.world.inventoryManager.addItem(items.itemWithID(0))
+            self.world.inventoryManager.addItem(items.itemWithID(1))
+
+        self.lastSaveHour = (self.world.day,
+                             self.world.time // AUTOSAVE_TICKS)
 
         self.endInventoryChangeFlash = 0
 
         self.clock = pygame.time.Clock()
         self.running = True
 
+        # Presentation
+        self.presentation = PRESENTATION
+        self.target: Surface | None = None
+        self.scale = 0
+        self.hudRects = list[Rect]()
+        self.lastHudRects = list[Rect]()
+        self.lastWorldState: tuple | None = None
+        # the entity sprites drawWorld drew and where, so present only
+        # notices entities on screen
+        self.drawnEntities = tuple[tuple[Surface, tuple[float, float]], ...]()
+
         # Debug
-        now = datetime.datetime.today()
-        self.positionsDebugFile = open(
-            "./debug/" + now.strftime("%Y_%m_%d-%I_%M_%S_%p") + "-positions.csv", "w")
-        labels = ["time", "x", "y"]
-        self.positionsDebugFile.write(",".join(labels)+"\n")
+        self.profiler = FrameProfiler(PROFILE_STAGES, PROFILE_HISTORY)
+        self.timers = self.profiler.timers
+        self.showProfile = False
+        self.profileGraph = Surface(PROFILE_GRAPH_SIZE)
+        self.profileText = CachedText(self.defaultFonts[8], color.WHITE)
+        self.profileSummary = ""
+
+        self.telemetry: PositionTelemetry | None = None
+        if POSITION_SAMPLE_RATE > 0:
+            now = datetime.datetime.today()
+            self.telemetry = PositionTelemetry(
+                "./debug/" + now.strftime("%Y_%m_%d-%I_%M_%S_%p") + "-positions.csv", POSITION_SAMPLE_RATE)
+
+        self.recorder: ActionRecorder | None = None
+        if RECORD_SESSIONS:
+            now = datetime.datetime.today()
+            self.recorder = ActionRecorder("./debug/" + now.strftime("%Y_%m_%d-%I_%M_%S_%p") + "-session.actions",
+                                           self.world, self.player)
+
+    def loadSave(self, path: str) -> bool:
+        """
+        Loads the save at path, returns whether there was one. A save that
+        cannot be read is kept aside and reported, and the world starts fresh.
+        """
+        try:
+            return loadGame(path, self.world, self.player)
+        except (ValueError, struct.error, zlib.error) as error:
+            print(f"could not load {path}: {error}")
+
+            os.replace(path, path + ".unreadable")
+            return False
 
     mouseReleased = True
 
@@ -304,6 +767,8 @@ class Game:
                 self.inputs.append(event.button)
             elif event.type == pygame.MOUSEBUTTONUP:
                 self.inputs.remove(event.button)
+            elif event.type == pygame.VIDEORESIZE:
+                self.target = None
 
     def processInputs(self):
         actions = list[Action]()
@@ -346,24 +811,106 @@ class Game:
         if self.inputs.consume(pygame.K_c):
             self.world.renderWorld()
 
+        if self.inputs.consume(pygame.K_F3):
+            self.showProfile = not self.showProfile
+            if self.showProfile:
+                self.rebuildProfileGraph()
+
+        if self.inputs.consume(pygame.K_F4):
+            now = datetime.datetime.today()
+            self.profiler.export(
+                "./debug/" + now.strftime("%Y_%m_%d-%I_%M_%S_%p") + "-frames.csv")
+
         self.actions = actions
 
     def update(self):
+        self.frameClock.tick()
+
+        if self.recorder != None:
+            self.recorder.record(self.frameClock.now(), self.actions)
+
         self.player.update(self.actions)
-        self.world.update(self.actions)
 
-    def render(self):
-        self.drawWorld()
-        self.drawHUD()
+        with self.timers["world.update"]:
+            self.world.update(self.actions)
 
-        pygame.transform.scale(
-            self.image, self.display.get_size(), self.display)
-        pygame.display.update()
+        with self.timers["entities.update"]:
+            self.entities.update()
 
-    def drawWorld(self):
-        # Background
-        self.image.fill(color.BLACK)
+        hour = (self.world.day, self.world.time // AUTOSAVE_TICKS)
+        if self.saves != None and hour != self.lastSaveHour:
+            self.saves.save(self.world, self.player).add_done_callback(
+                _reportSave)
+            self.lastSaveHour = hour
 
+    def render(self):
+        with self.timers["drawWorld"]:
+            self.drawWorld()
+        with self.timers["drawHUD"]:
+            self.drawHUD()
+
+        with self.timers["present"]:
+            self.present()
+
+    def present(self):
+        """Scales the frame onto the display, only updating the HUD when the world looks the same as last frame"""
+        rebuilt = self.target == None
+        if rebuilt:
+            self.buildTarget()
+        assert (self.target != None)
+
+        player = self.player
+        worldState = (player.pos.x, player.pos.y, player.state,
+                      player.direction, player.tick, self.drawnEntities)
+
+        if not rebuilt and self.scale > 0 and worldState == self.lastWorldState and self.world.redrawnCells == 0:
+            updated = list[Rect]()
+
+            for rect in self.lastHudRects + self.hudRects:
+                rect = rect.clip(self.image.get_rect())
+                if rect.width == 0 or rect.height == 0:
+                    continue
+
+                scaled = Rect(rect.x * self.scale, rect.y * self.scale,
+                              rect.width * self.scale, rect.height * self.scale)
+                with self.timers["scale"]:
+                    pygame.transform.scale(self.image.subsurface(
+                        rect), scaled.size, self.target.subsurface(scaled))
+                updated.append(scaled.move(self.target.get_abs_offset()))
+
+            with self.timers["display.update"]:
+                pygame.display.update(updated)
+        else:
+            with self.timers["scale"]:
+                pygame.transform.scale(
+                    self.image, self.target.get_size(), self.target)
+            with self.timers["display.update"]:
+                pygame.display.update()
+
+        self.lastWorldState = worldState
+        self.lastHudRects = self.hudRects
+
+    def buildTarget(self):
+        """Works out where frames go on the display, run again whenever the window is resized"""
+        self.display = pygame.display.get_surface()
+        width, height = self.display.get_size()
+        frameWidth, frameHeight = int(DISPLAY_WIDTH), int(DISPLAY_HEIGHT)
+
+        self.scale = min(width // frameWidth, height // frameHeight)
+
+        if self.presentation == Presentation.STRETCH or self.scale < 1:
+            # a window smaller than one frame can only be stretched
+            self.scale = 0
+            self.target = self.display
+            return
+
+        size = (frameWidth * self.scale, frameHeight * self.scale)
+        offset = ((width - size[0]) // 2, (height - size[1]) // 2)
+
+        self.display.fill(color.BLACK)
+        self.target = self.display.subsurface(Rect(offset, size))
+
+    def drawWorld(self):
         playerPos = self.player.pos
 
         # Character sprite location on screen
@@ -379,50 +926,56 @@ class Game:
         elif (WORLD_HEIGHT - playerPos.y) < (HALF_DISPLAY.y + CELL_SIZE + CELL_SIZE):
             spriteY = DISPLAY_HEIGHT - (WORLD_HEIGHT - playerPos.y)
 
-        nums = [str(time.time_ns()), str(playerPos.x - spriteX),
-                str(playerPos.y - spriteY)]
-        self.positionsDebugFile.write(",".join(nums) + "\n")
+        if self.telemetry != None:
+            self.telemetry.record(
+                time.time_ns(), playerPos.x - spriteX, playerPos.y - spriteY)
+
+        # Background and World Elements
+        left, top = playerPos.x - spriteX, playerPos.y - spriteY
+        self.compositor.draw(self.image, Rect(
+            left, top, DISPLAY_WIDTH, DISPLAY_HEIGHT))
 
-        # Base
-        self.image.blit(self.background, (0, 0),
-                        Rect(playerPos.x - spriteX, playerPos.y - spriteY, DISPLAY_WIDTH, DISPLAY_HEIGHT))
+        # Characters, back to front and only those in view
+        entities = self.entities
+        table = self.npcSprites.table
+        visible = entities.visibleIn(
+            left, top, left + DISPLAY_WIDTH, top + DISPLAY_HEIGHT)
 
-        # World Elements
-        self.image.blit(self.world.image, (0, 0),
-                        Rect(playerPos.x - spriteX, playerPos.y - spriteY, DISPLAY_WIDTH, DISPLAY_HEIGHT))
-        self.image.blit(self.world.overlayImage, (0, 0),
-                        Rect(playerPos.x - spriteX, playerPos.y - spriteY, DISPLAY_WIDTH, DISPLAY_HEIGHT))
+        xs = (entities.pos[visible, 0] - left).tolist()
+        ys = entities.pos[visible, 1]
+        sprites = [(table[state][direction][tick], (x, y)) for (x, y, state, direction, tick) in zip(
+            xs, (ys - top).tolist(), entities.state[visible].tolist(),
+            entities.direction[visible].tolist(), entities.tick[visible].tolist())]
+        self.drawnEntities = tuple(sprites)
 
-        # Character
-        self.image.blit(self.player.image(), (spriteX, spriteY))
+        # the player goes in front of every entity standing higher up
+        sprites.insert(int(np.searchsorted(ys, playerPos.y, side="right")),
+                       (self.player.image(), (spriteX, spriteY)))
+
+        self.image.blits(sprites, doreturn=False)
 
     def drawHUD(self):
         # FPS Counter
-        fpsSurface = self.defaultFonts[16].render(
-            str(round(self.clock.get_fps())), False, color.GREEN)
+        fpsSurface = self.fpsText.render(str(round(self.clock.get_fps())))
         fpsRect = fpsSurface.get_rect()
-        self.image.blit(
+        fpsDrawn = self.image.blit(
             fpsSurface, (0, DISPLAY_HEIGHT-fpsRect.height), fpsRect)
 
         # Clock
         worldTime = self.world.time
         timeRepr = f"{int(worldTime / 20)}:{((worldTime % 20) * 5):02}"
-        coinsSurface = self.defaultFonts[16].render(
-            timeRepr, False, color.RED4  # type: ignore
-        )
+        coinsSurface = self.clockText.render(timeRepr)
         coinsRect = coinsSurface.get_rect()
-        self.image.blit(
+        coinsDrawn = self.image.blit(
             coinsSurface, (DISPLAY_WIDTH-coinsRect.width-5, 5), coinsRect)
 
         # Inventory Bar
-        cellSize = CELL_SIZE + 2
-        slotSize = cellSize + 1
-        barWidth = 12 * (cellSize + 1)
-        xOffset = int((DISPLAY_WIDTH - barWidth) / 2)
-        yOffset = 25
+        cellSize = INVENTORY_CELL_SIZE
+        slotSize = INVENTORY_SLOT_SIZE
+        xOffset = INVENTORY_X
+        yOffset = INVENTORY_Y_OFFSET
 
-        self.image.fill(color.ORANGE2, Rect(
-            xOffset, DISPLAY_HEIGHT - 25, barWidth, cellSize))
+        self.image.blit(self.inventoryBar, (xOffset, DISPLAY_HEIGHT - yOffset))
 
         for i, item in enumerate(self.world.inventoryManager.currentItems):
             inventorySlotPos = Vector2(
@@ -440,6 +993,7 @@ class Game:
 
                     self.image.fill((int(255 * l), int(255 * l), int(255 * l)),
                                     Rect(inventorySlotPos.x, inventorySlotPos.y, cellSize, cellSize))
+                    self.image.blit(self.slotLabels[i], inventorySlotPos)
 
             # outline
             # outlinePos = Vector2(
@@ -448,10 +1002,6 @@ class Game:
             #     outlinePos.x, outlinePos.y, slotSize + 1, slotSize + 1), 1)
 
             # standard render for item
-            inventorySlotText = self.defaultFonts[8].render(
-                str(i), False, color.BLACK)
-            self.image.blit(inventorySlotText, inventorySlotPos)
-
             if item != None:
                 self.image.blit(self.itemRenderer.getImage(
                     item), inventorySlotPos)
@@ -461,18 +1011,82 @@ class Game:
         pygame.draw.rect(self.image, color.ORANGE4, Rect(
             outlinePos.x, outlinePos.y, slotSize + 1, slotSize + 1), 1)
 
+        # everything drawn above, including the selection outline
+        self.hudRects = [fpsDrawn, coinsDrawn, Rect(
+            xOffset - 1, DISPLAY_HEIGHT - yOffset - 1, INVENTORY_BAR_WIDTH + 2, slotSize + 2)]
+
+        if self.showProfile:
+            self.hudRects.append(self.drawProfile())
+
+    def drawProfile(self) -> Rect:
+        """Draws the frame time graph and percentiles in the top left, returns the area drawn on"""
+        profiler = self.profiler
+
+        if profiler.frame % PROFILE_TEXT_INTERVAL == 0 or self.profileSummary == "":
+            p50, p95, p99 = [ns / 1e6 for ns in profiler.percentiles()]
+            self.profileSummary = f"p50 {p50:.1f} p95 {p95:.1f} p99 {p99:.1f} ms"
+
+        # scroll the graph along and draw the frame that just finished
+        width, height = PROFILE_GRAPH_SIZE
+        self.profileGraph.scroll(-1, 0)
+        self._drawProfileColumn(width - 1, profiler.last())
+
+        self.image.blit(self.profileGraph, (0, 0))
+        text = self.profileText.render(self.profileSummary)
+        self.image.blit(text, (0, height))
+
+        return Rect(0, 0, max(width, text.get_width()), height + text.get_height())
+
+    def rebuildProfileGraph(self):
+        history = self.profiler.history()[-PROFILE_GRAPH_SIZE[0]:]
+        offset = PROFILE_GRAPH_SIZE[0] - len(history)
+
+        self.profileGraph.fill(color.BLACK)
+        for (i, ns) in enumerate(history.tolist()):
+            self._drawProfileColumn(offset + i, ns)
+
+    def _drawProfileColumn(self, x: int, ns: int):
+        height = PROFILE_GRAPH_SIZE[1]
+        # the frame budget sits half way up
+        budget = 1e9 / FRAME_LIMIT
+        barHeight = min(int(ns / budget * (height / 2)), height)
+
+        self.profileGraph.fill(color.BLACK, Rect(x, 0, 1, height))
+        self.profileGraph.fill(color.GREEN1 if ns <= budget else color.RED1,
+                               Rect(x, height - barHeight, 1, barHeight))
+        self.profileGraph.set_at((x, height // 2), color.YELLOW1)
+
     def run(self):
+        timers = self.timers
+
         while self.running:
-            self.captureInputs()
-            self.processInputs()
-            self.update()
-            self.render()
-            self.clock.tick(FRAME_LIMIT)
+            self.profiler.beginFrame()
+
+            with timers["captureInputs"]:
+                self.captureInputs()
+            with timers["processInputs"]:
+                self.processInputs()
+            with timers["update"]:
+                self.update()
+            with timers["render"]:
+                self.render()
+            with timers["tick"]:
+                self.clock.tick(FRAME_LIMIT)
+
+        if self.telemetry != None:
+            self.telemetry.close()
+
+        if self.recorder != None:
+            self.recorder.close()
 
-        self.positionsDebugFile.close()
+        if self.saves != None:
+            self.saves.save(self.world, self.player,
+                            full=True).add_done_callback(_reportSave)
+            self.saves.close()
 
 
-game = Game()
-game.run()
+if __name__ == "__main__":
+    game = Game()
+    game.run()
 
-pygame.quit()
+    pygame.quit()
@@ -0,0 +1,71 @@
+from typing import TYPE_CHECKING, Callable
+
+from items import Crop
+
+if TYPE_CHECKING:
+    from controller import CropTile
+    from tilegrid import TileGrid
+
+TICKS_PER_DAY = 480
+
+GrowthListener = Callable[[int, int, "CropTile"], None]
+
+
+def growthStage(crop: Crop, elapsed: int) -> int:
+    """Sprite frame of crop elapsed ticks after it was planted"""
+    last = crop.stages - 1
+    growTicks = crop.matures * TICKS_PER_DAY
+
+    if elapsed >= growTicks:
+        return last
+
+    # rounds last * elapsed / growTicks half up, in integers
+    return ((2 * last * elapsed) + growTicks) // (2 * growTicks)
+
+
+def nextStageAt(crop: Crop, stage: int) -> int | None:
+    """Ticks after planting at which crop leaves stage, or None once it is mature"""
+    last = crop.stages - 1
+
+    if stage >= last:
+        return None
+
+    growTicks = crop.matures * TICKS_PER_DAY
+
+    return -(-((2 * stage) + 1) * growTicks // (2 * last))
+
+
+class GrowthScheduler:
+    """
+    Owns the tick crops grow against and fires an event whenever a crop
+    changes growth stage. Ages are derived from the tick a crop was planted
+    on, so nothing is stored per crop as time passes. Which crops are due
+    is worked out by the tile storage in one vectorized pass.
+    """
+
+    def __init__(self, tiles: "TileGrid") -> None:
+        self.tiles = tiles
+        self.tick = 0
+        self.listeners = list[GrowthListener]()
+
+    def __len__(self) -> int:
+        return self.tiles.growingCount
+
+    def plant(self, tile: "CropTile"):
+        tile.plantedTick = self.tick
+        tile.growth = self
+
+    def advance(self, elapsed: int):
+        """Provide the amount of time elapsed in game ticks. There are 480 game ticks in a day"""
+        self.tick += elapsed
+
+        changed = self.tiles.advanceGrowth(self.tick)
+
+        if len(self.listeners) == 0:
+            return
+
+        for (x, y) in changed:
+            tile = self.tiles.get(x, y)
+
+            for listener in self.listeners:
+                listener(x, y, tile)  # type: ignore
@@ -0,0 +1,118 @@
+import argparse
+import os
+import time
+from typing import TYPE_CHECKING, Iterable
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import items
+from constants import *
+from controller import (TICK_LENGTH, Action, Character, Coord, HoeAreaAction,
+                        IncrementDayAction, PlantAreaAction, TileArea, World)
+from entities import EntityManager
+from items import Seed
+from timing import FixedClock
+
+if TYPE_CHECKING:
+    from actionlog import ActionLog
+
+Script = dict[int, list[Action]]
+
+
+class HeadlessRunner:
+    """
+    Steps a World and its characters at a fixed tick on a FixedClock,
+    without a display. Every step advances the clock by tickLength
+    nanoseconds, so scripted runs are deterministic.
+    """
+
+    def __init__(self, tickLength: int = int(1e9 / FRAME_LIMIT), sparse: bool = False, npcs: int = 0) -> None:
+        """npcs wandering entities are spawned from a fixed seed, they never change the world"""
+        self.tickLength = tickLength
+        self.clock = FixedClock()
+
+        self.world = World(self.clock, sparse)
+        self.player = Character(self.world)
+
+        self.entities = EntityManager(self.world, seed=0)
+        self.entities.spawnRandom(npcs)
+
+        self.frame = 0
+
+    def step(self, actions: list[Action] | None = None):
+        if actions == None:
+            actions = list[Action]()
+
+        self.clock.advance(self.tickLength)
+        self._update(actions)
+
+    def stepAt(self, now: int, actions: list[Action]):
+        """Steps with the clock at now instead of a tick later"""
+        self.clock.time = now
+        self._update(actions)
+
+    def _update(self, actions: list[Action]):
+        self.player.update(actions)
+        self.world.update(actions)
+        self.entities.update()
+
+        self.frame += 1
+
+    def run(self, script: Iterable[list[Action]]):
+        """Steps once for every list of actions in script"""
+        for actions in script:
+            self.step(actions)
+
+    def runScript(self, script: Script, frames: int):
+        """Steps frames times, feeding the actions keyed by frame number"""
+        for _ in range(frames):
+            self.step(script.get(self.frame, []))
+
+    def replay(self, log: "ActionLog"):
+        """
+        Steps through every frame of a recorded session at the clock time it
+        was recorded at, from the state the recording started in.
+        """
+        log.restore(self.world, self.player)
+
+        for (_, now, actions) in log.frames:
+            self.stepAt(now, actions)
+
+    def runDays(self, days: int):
+        """Skips ahead one in-game day per step"""
+        for _ in range(days):
+            self.step([IncrementDayAction()])
+
+
+def fieldScript(x: int, y: int, width: int, height: int, seed: Seed) -> list[list[Action]]:
+    """Tills and plants a field, one frame for each"""
+    field = TileArea(Coord(x, y), width, height)
+
+    return [
+        [HoeAreaAction(field)],
+        [PlantAreaAction(field, seed)],
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the world without a display at a fixed tick")
+    parser.add_argument("--days", type=int, default=10000)
+    parser.add_argument("--field", type=int, default=10,
+                        help="side length of the planted field in tiles")
+    parser.add_argument("--sparse", action="store_true",
+                        help="store tiles in sparse chunks")
+    args = parser.parse_args()
+
+    seed = items.itemWithID(1)
+    assert (isinstance(seed, Seed))
+
+    runner = HeadlessRunner(TICK_LENGTH, args.sparse)
+    runner.run(fieldScript(1, 1, args.field, args.field, seed))
+
+    start = time.perf_counter()
+    runner.runDays(args.days)
+    elapsed = time.perf_counter() - start
+
+    print(f"simulated {args.days} days in {elapsed:.3f}s "
+          f"({args.days / elapsed:.0f} days/s)")
@@ -1,5 +1,10 @@
 import enum
 import json
+import os
+
+# relative to this file, so the game can be started from any directory
+ITEMS_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "assets", "items.json")
 
 
 class ItemType(enum.Enum):
@@ -36,20 +41,17 @@ class Crop(Item):
         self.matures = int(item["matures"])
         self.season = str(item["season"])
 
+        # renderPos is "sprite row:harvested column:growth sprite count"
+        self.stages = int(self.renderPos.split(":")[2])
+
 class Seed(Item):
+    # resolved from plantsID once the registry has loaded every item
+    plants: Crop
+
     def __init__(self, item: dict[str, (str | int | float | bool)]) -> None:
         super().__init__(item)
 
         self.plantsID = int(item["plants"])
-    
-    @property
-    def plants(self) -> Crop:
-        item = itemWithID(self.plantsID)
-
-        if isinstance(item, Crop):
-            return item
-        else:
-            raise ValueError(f"{self.name} must plant type crop")
 
 class ItemFactory():
     def build(self, item: dict[str, (str | int | float | bool)]) -> Item:
@@ -74,15 +76,99 @@ class ItemStack:
         self.count -= count
 
 
-"""BEGIN SCRIPT"""
+class ItemRegistry:
+    """
+    Every item definition, read from path the first time any of them is
+    asked for and indexed by id, name and type. Which crop each seed plants
+    is checked and resolved once while loading.
+    """
+
+    def __init__(self, path: str = ITEMS_PATH) -> None:
+        self.path = path
+
+        self._byID: dict[int, Item] | None = None
+        self._byName = dict[str, Item]()
+        self._byType = dict[ItemType, list[Item]]()
+
+    def _load(self) -> dict[int, Item]:
+        factory = ItemFactory()
+
+        with open(self.path) as file:
+            definitions = json.load(file)
+
+        # built aside and only kept once every definition loads, so a failed
+        # load leaves nothing half indexed for the next attempt
+        byID = dict[int, Item]()
+        byName = dict[str, Item]()
+        byType = dict[ItemType, list[Item]]()
+        for definition in definitions:
+            item = factory.build(definition)
+
+            if item.id in byID:
+                raise ValueError(f"item id {item.id} is used more than once")
+
+            byID[item.id] = item
+            byName[item.name] = item
+            byType.setdefault(item.type, []).append(item)
+
+        for item in byID.values():
+            if isinstance(item, Seed):
+                crop = byID.get(item.plantsID)
+
+                if not isinstance(crop, Crop):
+                    raise ValueError(f"{item.name} must plant type crop")
+
+                item.plants = crop
+
+        self._byID = byID
+        self._byName = byName
+        self._byType = byType
+
+        return byID
+
+    @property
+    def loaded(self) -> bool:
+        return self._byID != None
+
+    def _items(self) -> dict[int, Item]:
+        if self._byID == None:
+            return self._load()
+
+        return self._byID
+
+    def withID(self, id: int) -> Item:
+        items = self._items()
+
+        if id not in items:
+            raise KeyError(f"no item with id {id}")
+
+        return items[id]
+
+    def withName(self, name: str) -> Item:
+        self._items()
+
+        if name not in self._byName:
+            raise KeyError(f"no item named {name}")
+
+        return self._byName[name]
+
+    def ofType(self, type: ItemType) -> list[Item]:
+        self._items()
+
+        return list(self._byType.get(type, []))
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._items()
+
+    def __len__(self) -> int:
+        return len(self._items())
+
+    def __iter__(self):
+        return iter(self._items().values())
 
-allItems = list[Item]()
-itemsJson = json.loads(open("./assets/items.json").read())
 
-factory = ItemFactory()
+registry = ItemRegistry()
 
-for item in itemsJson:
-    allItems.append(factory.build(item))
 
-def itemWithID(id: int):
-    return allItems[id]
+def itemWithID(id: int) -> Item:
+    return registry.withID(id)
@@ -0,0 +1,272 @@
+import hashlib
+import mmap
+import os
+import struct
+from xml.etree import ElementTree
+
+import numpy as np
+import pygame
+from pytmx import TiledMap, TiledObjectGroup, TiledTileLayer  # type: ignore
+from pytmx.util_pygame import handle_transformation  # type: ignore
+
+# bump whenever the layout below changes, so old caches are seen as stale
+CACHE_VERSION = 1
+CACHE_MAGIC = b"MDMC"
+# magic, version, sha256 of the sources, width, height, tile size,
+# tile layer count, spawn x, spawn y, polygon count, point count, length of
+# the source path list
+HEADER_FORMAT = struct.Struct("<4sI32sHHHHddIII")
+# sections start on this boundary so numpy can view them in place
+ALIGNMENT = 16
+
+
+def cachePath(path: str) -> str:
+    """Where the compiled form of the map at path is kept"""
+    return os.path.splitext(path)[0] + ".mapcache"
+
+
+def sourceHash(sources: list[str]) -> bytes:
+    digest = hashlib.sha256(CACHE_VERSION.to_bytes(4, "little"))
+
+    for source in sources:
+        with open(source, "rb") as file:
+            digest.update(file.read())
+
+    return digest.digest()
+
+
+class CompiledMap:
+    """
+    Everything the game needs from a Tiled map: the gid of every tile
+    layer cell, the tile layers flattened into one RGBA image, the
+    collision polygons and the spawn point. Built from the TMX by compile
+    or read back from a cache file by load, in which case the arrays and
+    the image are views over the memory mapped file.
+    """
+
+    def __init__(self, width: int, height: int, tileSize: int, layers: np.ndarray, pixels: np.ndarray,
+                 polygons: list[list[tuple[float, float]]], spawnPoint: tuple[float, float], sources: list[str]) -> None:
+        self.width = width
+        self.height = height
+        self.tileSize = tileSize
+        # gids indexed [layer, y, x], 0 where a layer has no tile
+        self.layers = layers
+        # RGBA bytes, tileSize * height rows of tileSize * width pixels
+        self.pixels = pixels
+        self.polygons = polygons
+        self.spawnPoint = spawnPoint
+        # files the map was built from, the map itself first
+        self.sources = sources
+
+        self._mmap: mmap.mmap | None = None
+
+    @property
+    def pixelSize(self) -> tuple[int, int]:
+        return (self.width * self.tileSize, self.height * self.tileSize)
+
+    def image(self) -> pygame.Surface:
+        """The tile layers drawn in order onto a transparent surface. Shares memory with pixels"""
+        return pygame.image.frombuffer(self.pixels, self.pixelSize, "RGBA")  # type: ignore
+
+    @staticmethod
+    def compile(path: str) -> "CompiledMap":
+        """Parses the TMX at path and renders its tile layers"""
+        sources = [path]
+        mapData = TiledMap(path, image_loader=_tileLoader(sources))
+
+        for tileset in ElementTree.parse(path).getroot().iter("tileset"):
+            source = tileset.get("source")
+            if source != None:
+                sources.append(os.path.join(os.path.dirname(path), source))
+
+        tileLayers = [layer for layer in mapData.layers  # type: ignore
+                      if isinstance(layer, TiledTileLayer)]
+
+        layers = np.zeros((len(tileLayers), mapData.height,
+                           mapData.width), np.uint32)
+        for i, layer in enumerate(tileLayers):
+            layers[i] = np.array(layer.data, np.uint32)
+
+        tileSize = mapData.tilewidth
+        image = pygame.Surface((mapData.width * tileSize,
+                                mapData.height * tileSize), pygame.SRCALPHA, 32)
+
+        for (layer, y, x), gid in np.ndenumerate(layers):
+            tile = mapData.images[gid]  # type: ignore
+
+            if isinstance(tile, pygame.Surface):
+                image.blit(tile, (x * tileSize, y * tileSize))
+
+        pixels = np.frombuffer(
+            pygame.image.tostring(image, "RGBA"), np.uint8)
+
+        polygons = list[list[tuple[float, float]]]()
+        collisionLayer: TiledObjectGroup = mapData.get_layer_by_name(
+            "Collision Objects")
+        for object in collisionLayer:  # type: ignore
+            polygons.append([(float(x), float(y))
+                            for (x, y) in object.as_points])  # type: ignore
+
+        spawnPoint = mapData.get_object_by_name(  # type: ignore
+            "spawnPoint")
+
+        return CompiledMap(mapData.width, mapData.height, tileSize, layers, pixels,
+                           polygons, (float(spawnPoint.x), float(spawnPoint.y)), sources)
+
+    def save(self, path: str):
+        """Writes the cache file, replacing any old one only once it is complete"""
+        sourceList = "\n".join(self.sources).encode()
+        counts = np.array([len(polygon)
+                          for polygon in self.polygons], np.uint32)
+        points = np.array([point for polygon in self.polygons for point in polygon],
+                          np.float64).reshape(-1, 2)
+
+        header = HEADER_FORMAT.pack(CACHE_MAGIC, CACHE_VERSION, sourceHash(self.sources),
+                                    self.width, self.height, self.tileSize, len(
+                                        self.layers),
+                                    self.spawnPoint[0], self.spawnPoint[1],
+                                    len(counts), len(points), len(sourceList))
+
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            for section in [header, sourceList, counts.tobytes(), points.tobytes(),
+                            self.layers.astype("<u4").tobytes(), self.pixels.tobytes()]:
+                file.write(section)
+                file.write(bytes(-file.tell() % ALIGNMENT))
+
+        os.replace(temporary, path)
+
+    @staticmethod
+    def load(path: str) -> "CompiledMap | None":
+        """Maps the cache file at path, or returns None if it is missing, corrupt or older than its sources"""
+        try:
+            with open(path, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            (magic, version, digest, width, height, tileSize, layerCount, spawnX, spawnY,
+             polygonCount, pointCount, sourceLength) = HEADER_FORMAT.unpack_from(buffer)
+
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                return None
+
+            offset = _aligned(HEADER_FORMAT.size)
+            sources = bytes(
+                buffer[offset:offset + sourceLength]).decode().split("\n")
+            offset = _aligned(offset + sourceLength)
+
+            if sourceHash(sources) != digest:
+                return None
+
+            counts = np.frombuffer(buffer, np.uint32, polygonCount, offset)
+            offset = _aligned(offset + counts.nbytes)
+
+            points = np.frombuffer(buffer, np.float64,
+                                   pointCount * 2, offset).reshape(-1, 2)
+            offset = _aligned(offset + points.nbytes)
+
+            layers = np.frombuffer(buffer, "<u4", layerCount * height * width,
+                                   offset).reshape(layerCount, height, width)
+            offset = _aligned(offset + layers.nbytes)
+
+            pixels = np.frombuffer(buffer, np.uint8, width * tileSize *
+                                   height * tileSize * 4, offset)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            return None
+
+        polygons = list[list[tuple[float, float]]]()
+        start = 0
+        for count in counts.tolist():
+            polygons.append([(x, y)
+                            for (x, y) in points[start:start + count].tolist()])
+            start += count
+
+        compiled = CompiledMap(width, height, tileSize, layers, pixels,
+                               polygons, (spawnX, spawnY), sources)
+        compiled._mmap = buffer
+
+        return compiled
+
+
+def _tileLoader(sources: list[str]):
+    """
+    A pytmx image loader that needs no display. Tiles come out looking the
+    way pytmx.util_pygame.smart_convert would draw them, as per pixel alpha
+    surfaces: a colour keyed or fully opaque tile loses its alpha, and the
+    key colour becomes transparent.
+    """
+
+    def loader(filename: str, colorkey: str | None, **kwargs):
+        sheet = pygame.image.load(filename)
+        sources.append(filename)
+
+        key = pygame.Color(f"#{colorkey}") if colorkey else None
+
+        def load(rect=None, flags=None) -> pygame.Surface:
+            tile = sheet.subsurface(rect) if rect else sheet
+            if flags:
+                tile = handle_transformation(tile, flags)
+
+            if tile.get_flags() & pygame.SRCALPHA:
+                tile = tile.copy()
+            else:
+                opaque = tile
+                tile = pygame.Surface(opaque.get_size(), pygame.SRCALPHA, 32)
+                tile.blit(opaque, (0, 0))
+
+            size = tile.get_width() * tile.get_height()
+
+            if key != None or pygame.mask.from_surface(tile, 254).count() == size:
+                alpha = pygame.surfarray.pixels_alpha(tile)
+                alpha[:] = 255
+
+                if key != None:
+                    rgb = pygame.surfarray.pixels3d(tile)
+                    alpha[(rgb == (key.r, key.g, key.b)).all(axis=2)] = 0
+                    del rgb
+
+                del alpha
+
+            return tile
+
+        return load
+
+    return loader
+
+
+def _aligned(offset: int) -> int:
+    return offset + (-offset % ALIGNMENT)
+
+
+def loadMap(path: str) -> CompiledMap:
+    """
+    The compiled map for the TMX at path, from its cache when that is
+    current. Otherwise the TMX is parsed and the cache rewritten.
+    """
+    compiled = CompiledMap.load(cachePath(path))
+
+    if compiled == None:
+        compiled = CompiledMap.compile(path)
+
+        try:
+            compiled.save(cachePath(path))
+        except OSError:
+            pass  # a read only install still runs, just without the cache
+
+    return compiled
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from controller import MAP_PATH
+
+    parser = argparse.ArgumentParser(
+        description="Compiles a Tiled map into the binary cache read at start up")
+    parser.add_argument("path", nargs="?", default=MAP_PATH)
+    args = parser.parse_args()
+
+    CompiledMap.compile(args.path).save(cachePath(args.path))
+    print(f"wrote {cachePath(args.path)}")
@@ -0,0 +1,105 @@
+import os
+import time
+
+import numpy as np
+
+# the whole loop iteration, first column of every sample
+FRAME = "frame"
+
+
+class StageTimer:
+    """Adds the nanoseconds spent inside a with block to one stage of the current frame"""
+
+    __slots__ = ("profiler", "column", "start")
+
+    def __init__(self, profiler: "FrameProfiler", column: int) -> None:
+        self.profiler = profiler
+        self.column = column
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exception):
+        self.profiler.current[self.column] += time.perf_counter_ns() - \
+            self.start
+
+
+class FrameProfiler:
+    """
+    Per frame stage times in nanoseconds, for the last capacity frames in
+    a ring buffer. Stages are timed with the reusable StageTimer in
+    timers, so timing a frame allocates nothing. Stages may nest, a nested
+    stage's time is also counted in the stage around it.
+    """
+
+    def __init__(self, stages: list[str], capacity: int = 600) -> None:
+        self.stages = [FRAME] + stages
+        self.capacity = capacity
+
+        self.samples = np.zeros((capacity, len(self.stages)), np.int64)
+        # perf_counter_ns at the start of each frame
+        self.starts = np.zeros(capacity, np.int64)
+        self.frame = 0
+
+        self.timers = {stage: StageTimer(self, column)
+                       for column, stage in enumerate(self.stages)}
+
+        self.current = self.samples[0]
+        self._frameStart: int | None = None
+
+    def beginFrame(self):
+        """Closes the previous frame, so frame time includes everything up to this call"""
+        now = time.perf_counter_ns()
+
+        if self._frameStart != None:
+            self.current[0] = now - self._frameStart
+            self.frame += 1
+
+        self._frameStart = now
+
+        row = self.frame % self.capacity
+        self.current = self.samples[row]
+        self.current[:] = 0
+        self.starts[row] = now
+
+    @property
+    def count(self) -> int:
+        """Number of finished frames held"""
+        return min(self.frame, self.capacity)
+
+    def history(self, stage: str = FRAME) -> np.ndarray:
+        """Times of stage over the finished frames held, oldest first"""
+        column = self.stages.index(stage)
+        rows = (np.arange(self.frame - self.count, self.frame)) % self.capacity
+
+        return self.samples[rows, column]
+
+    def last(self, stage: str = FRAME) -> int:
+        if self.frame == 0:
+            return 0
+
+        return int(self.samples[(self.frame - 1) % self.capacity, self.stages.index(stage)])
+
+    def percentiles(self, stage: str = FRAME, ranks: tuple[float, ...] = (50, 95, 99)) -> list[float]:
+        """Nanosecond percentiles of stage over the frames held"""
+        if self.count == 0:
+            return [0.0 for _ in ranks]
+
+        return np.percentile(self.history(stage), ranks).tolist()
+
+    def export(self, path: str):
+        """Writes every frame held as CSV, a row a frame with each stage in nanoseconds"""
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        rows = (np.arange(self.frame - self.count, self.frame)) % self.capacity
+        frames = np.arange(self.frame - self.count, self.frame)
+
+        table = np.column_stack(
+            [frames, self.starts[rows], self.samples[rows]])
+        header = ",".join(["index", "start"] + self.stages)
+
+        np.savetxt(path, table, fmt="%d", delimiter=",",
+                   header=header, comments="")
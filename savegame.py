@@ -0,0 +1,375 @@
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from pygame.math import Vector2
+
+import items
+from controller import (INVENTORY_ROW_SIZE, SAVE_CHUNK_SIZE, Character,
+                        Direction, InventoryManager, World)
+from items import ItemStack
+from tilegrid import EMPTY, NO_CROP
+
+# bump whenever the layout below changes, saves of other versions are refused
+SAVE_VERSION = 2
+SAVE_MAGIC = b"MDSV"
+# magic, version
+FILE_HEADER_FORMAT = struct.Struct("<4sI")
+# kind, length and crc32 of the compressed snapshot that follows
+RECORD_FORMAT = struct.Struct("<BII")
+# day, time, coins, growth tick, player x, player y, player direction, world
+# width, world height, chunk size, inventory slot count, row selection, slot
+# selection, chunk count
+STATE_FORMAT = struct.Struct("<iiqqddBIIHHBBI")
+# item id and count of an inventory slot
+SLOT_FORMAT = struct.Struct("<HI")
+# item id of an empty inventory slot
+EMPTY_SLOT = 0xFFFF
+# chunk x, chunk y, whether the chunk is empty and no arrays follow
+CHUNK_FORMAT = struct.Struct("<II?")
+
+# a record that replaces everything before it
+FULL = 0
+# a record of the chunks changed since the record before it
+DELTA = 1
+
+# cheap compression, tile arrays are mostly runs of the same value
+COMPRESSION_LEVEL = 1
+
+# chunk position, types, crops and planted ticks, None arrays for an empty chunk
+Chunk = tuple[int, int, np.ndarray | None, np.ndarray | None, np.ndarray | None]
+
+
+class WorldSnapshot:
+    """
+    A copy of everything a save keeps: the world's clock, coins and
+    inventory, where the player stands, and the tiles of some chunks. A
+    full snapshot holds every chunk with tiles in it, a delta only the
+    chunks it was asked for. Taking one only copies arrays, packing it into
+    bytes is left to pack so it can happen on another thread.
+    """
+
+    def __init__(self, full: bool, state: tuple, slots: list[tuple[int, int]], chunks: list[Chunk]) -> None:
+        self.full = full
+        # the fields of STATE_FORMAT but the chunk count
+        self.state = state
+        # item id and count of every inventory slot, EMPTY_SLOT ids are empty
+        self.slots = slots
+        self.chunks = chunks
+
+    @staticmethod
+    def capture(world: World, player: Character, full: bool = True) -> "WorldSnapshot":
+        """Copies the state of world and player, with every chunk when full, otherwise its unsaved chunks"""
+        tiles = world._tiles
+        inventory = world.inventoryManager
+
+        keys = tiles.occupiedChunks(
+            SAVE_CHUNK_SIZE) if full else world.unsavedChunks
+
+        chunks = list[Chunk]()
+        for (cx, cy) in sorted(keys):
+            x0, y0 = cx * SAVE_CHUNK_SIZE, cy * SAVE_CHUNK_SIZE
+            types, crops, planted = tiles.region(x0, y0, min(x0 + SAVE_CHUNK_SIZE, tiles.width),
+                                                 min(y0 + SAVE_CHUNK_SIZE, tiles.height))
+
+            if np.all(types == EMPTY):
+                chunks.append((cx, cy, None, None, None))
+            else:
+                chunks.append((cx, cy, types, crops, planted))
+
+        slots = list[tuple[int, int]]()
+        for slot in inventory.items:
+            if slot == None:
+                slots.append((EMPTY_SLOT, 0))
+            elif isinstance(slot, ItemStack):
+                slots.append((slot.item.id, slot.count))
+            else:
+                slots.append((slot.id, 1))
+
+        state = (world.day, world.time, world.coins, world.growth.tick, player.pos.x, player.pos.y,
+                 player.direction.value, tiles.width, tiles.height, SAVE_CHUNK_SIZE, len(slots),
+                 inventory.rowSelection, inventory.slotSelection)
+
+        return WorldSnapshot(full, state, slots, chunks)
+
+    def pack(self) -> bytes:
+        """The snapshot as a record, header included"""
+        parts = [STATE_FORMAT.pack(*self.state, len(self.chunks))]
+        parts.extend(SLOT_FORMAT.pack(*slot) for slot in self.slots)
+
+        for (cx, cy, types, crops, planted) in self.chunks:
+            parts.append(CHUNK_FORMAT.pack(cx, cy, types is None))
+
+            if types is not None and crops is not None and planted is not None:
+                parts.append(types.tobytes())
+                parts.append(crops.astype("<i2").tobytes())
+                parts.append(planted.astype("<i8").tobytes())
+
+        payload = zlib.compress(b"".join(parts), COMPRESSION_LEVEL)
+
+        return RECORD_FORMAT.pack(FULL if self.full else DELTA, len(payload), zlib.crc32(payload)) + payload
+
+    @staticmethod
+    def unpack(kind: int, payload: bytes) -> "WorldSnapshot":
+        data = zlib.decompress(payload)
+
+        fields = STATE_FORMAT.unpack_from(data)
+        state, chunkCount = fields[:-1], fields[-1]
+        width, height, chunkSize, slotCount = state[7:11]
+        offset = STATE_FORMAT.size
+
+        slots = list[tuple[int, int]](SLOT_FORMAT.iter_unpack(
+            data[offset:offset + (slotCount * SLOT_FORMAT.size)]))
+        offset += slotCount * SLOT_FORMAT.size
+
+        chunks = list[Chunk]()
+        for _ in range(chunkCount):
+            cx, cy, empty = CHUNK_FORMAT.unpack_from(data, offset)
+            offset += CHUNK_FORMAT.size
+
+            if empty:
+                chunks.append((cx, cy, None, None, None))
+                continue
+
+            shape = (min(chunkSize, width - (cx * chunkSize)),
+                     min(chunkSize, height - (cy * chunkSize)))
+            cells = shape[0] * shape[1]
+
+            types = np.frombuffer(data, np.uint8, cells, offset).reshape(shape)
+            offset += cells
+            crops = np.frombuffer(data, "<i2", cells, offset).reshape(shape)
+            offset += cells * 2
+            planted = np.frombuffer(data, "<i8", cells, offset).reshape(shape)
+            offset += cells * 8
+
+            chunks.append((cx, cy, types, crops, planted))
+
+        return WorldSnapshot(kind == FULL, state, slots, chunks)
+
+    def check(self, world: World):
+        """Raises ValueError when the snapshot cannot be put into world"""
+        width, height = self.state[7:9]
+        tiles = world._tiles
+
+        if (width, height) != (tiles.width, tiles.height):
+            raise ValueError(
+                f"the save is of a {width}x{height} world, not {tiles.width}x{tiles.height}")
+
+        for (id, _) in self.slots:
+            if id != EMPTY_SLOT and id not in items.registry:
+                raise ValueError(f"the save holds an unknown item {id}")
+
+        # raises ValueError for a direction that does not exist
+        Direction(self.state[6])
+
+    def apply(self, world: World, player: Character):
+        """
+        Puts the snapshot into world and player. A delta only makes sense on
+        top of the snapshots taken before it.
+        """
+        self.check(world)
+
+        (day, time, coins, tick, x, y, direction, width, height, chunkSize,
+         slotCount, rowSelection, slotSelection) = self.state
+        tiles = world._tiles
+
+        if self.full:
+            tiles.reset()
+
+        for (cx, cy, types, crops, planted) in self.chunks:
+            x0, y0 = cx * chunkSize, cy * chunkSize
+
+            if types is None or crops is None or planted is None:
+                shape = (min(chunkSize, width - x0), min(chunkSize, height - y0))
+                types = np.full(shape, EMPTY, np.uint8)
+                crops = np.full(shape, NO_CROP, np.int16)
+                planted = np.zeros(shape, np.int64)
+
+            tiles.setRegion(x0, y0, types, crops, planted)
+
+        world.growth.tick = tick
+        # works out the growth stage of every crop that was set
+        tiles.advanceGrowth(tick)
+
+        world.day, world.time, world.coins = day, time, coins
+
+        inventory = world.inventoryManager
+        if slotCount != len(inventory.items):
+            inventory = world.inventoryManager = InventoryManager(
+                slotCount // INVENTORY_ROW_SIZE)
+
+        for (index, (id, count)) in enumerate(self.slots):
+            inventory.setSlot(index, None if id ==
+                              EMPTY_SLOT else items.itemWithID(id), count)
+
+        inventory.rowSelection = rowSelection
+        inventory.slotSelection = slotSelection
+
+        player.pos = Vector2(x, y)
+        player.direction = Direction(direction)
+
+
+class SaveWriter:
+    """
+    Writes snapshots of a world to one save file on a background thread.
+    The first save and any that follow a failed write are full, written to
+    a temporary file that then replaces the save, so a crash part way
+    leaves the old save whole. Every other save appends a delta of only the
+    chunks changed since the one before, and a delta torn by a crash is
+    dropped on load. Once the deltas outgrow the last full save, the next
+    save is full again. The chunks of a write that failed go back to the
+    world's unsaved chunks with the next save.
+    """
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+
+        self.fullBytes = 0
+        self.deltaBytes = 0
+        self.saves = 0
+
+        # guards everything below, which the writer thread sets
+        self._lock = threading.Lock()
+        # set by a failed write, cleared only once a full save is written
+        self._failed = True
+        # chunks of deltas that failed or were skipped since a failure
+        self._lost = set[tuple[int, int]]()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="save-writer")
+
+    def save(self, world: World, player: Character, full: bool = False) -> "Future[None]":
+        """
+        Takes a snapshot of world and player now and queues it to be written.
+        The returned future holds any error writing it raised.
+        """
+        with self._lock:
+            full = full or self._failed or self.deltaBytes > self.fullBytes
+
+            world.unsavedChunks |= self._lost
+            self._lost = set[tuple[int, int]]()
+
+        snapshot = WorldSnapshot.capture(world, player, full)
+        world.unsavedChunks = set[tuple[int, int]]()
+
+        return self._executor.submit(self._write, snapshot)
+
+    def _write(self, snapshot: WorldSnapshot):
+        with self._lock:
+            failed = self._failed
+
+        if not snapshot.full and failed:
+            self._lose(snapshot)
+            return  # the full save that must follow a failure covers this
+
+        try:
+            record = snapshot.pack()
+
+            if snapshot.full:
+                temporary = self.path + ".tmp"
+                with open(temporary, "wb") as file:
+                    file.write(FILE_HEADER_FORMAT.pack(
+                        SAVE_MAGIC, SAVE_VERSION))
+                    file.write(record)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                os.replace(temporary, self.path)
+            else:
+                with open(self.path, "ab") as file:
+                    file.write(record)
+                    file.flush()
+                    os.fsync(file.fileno())
+        except Exception:
+            with self._lock:
+                self._failed = True
+            self._lose(snapshot)
+            raise
+
+        with self._lock:
+            if snapshot.full:
+                self.fullBytes = len(record)
+                self.deltaBytes = 0
+                self._failed = False
+            else:
+                self.deltaBytes += len(record)
+
+            self.saves += 1
+
+    def _lose(self, snapshot: WorldSnapshot):
+        """Keeps the chunks of a delta that was not written for the next save"""
+        if snapshot.full:
+            return  # the next full save has every chunk anyway
+
+        with self._lock:
+            self._lost.update((cx, cy)
+                              for (cx, cy, _, _, _) in snapshot.chunks)
+
+    def close(self):
+        """Waits for every queued save to be written"""
+        self._executor.shutdown(wait=True)
+
+
+def readSave(path: str) -> list[WorldSnapshot]:
+    """
+    The snapshots in the save at path from its last full one on, in order.
+    Reading stops at the first record that is cut short or corrupt.
+    """
+    with open(path, "rb") as file:
+        buffer = file.read()
+
+    magic, version = FILE_HEADER_FORMAT.unpack_from(buffer)
+
+    if magic != SAVE_MAGIC:
+        raise ValueError(f"{path} is not a save")
+    if version != SAVE_VERSION:
+        raise ValueError(
+            f"{path} is version {version}, only {SAVE_VERSION} can be read")
+
+    snapshots = list[WorldSnapshot]()
+    offset = FILE_HEADER_FORMAT.size
+
+    while offset + RECORD_FORMAT.size <= len(buffer):
+        kind, length, crc = RECORD_FORMAT.unpack_from(buffer, offset)
+        offset += RECORD_FORMAT.size
+
+        payload = buffer[offset:offset + length]
+        offset += length
+
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+
+        if kind == FULL:
+            snapshots.clear()
+
+        snapshots.append(WorldSnapshot.unpack(kind, payload))
+
+    return snapshots
+
+
+def loadGame(path: str, world: World, player: Character) -> bool:
+    """
+    Puts the save at path into world and player, returns whether there was
+    one. A save that cannot be read raises before anything is put in.
+    """
+    if not os.path.exists(path):
+        return False
+
+    snapshots = readSave(path)
+
+    for snapshot in snapshots:
+        snapshot.check(world)
+
+    for snapshot in snapshots:
+        snapshot.apply(world, player)
+
+    world.unsavedChunks = set[tuple[int, int]]()
+
+    return len(snapshots) > 0
@@ -0,0 +1,112 @@
+import collections
+import gzip
+import os
+import struct
+import threading
+from typing import IO
+
+# binary files start with this, followed by one SAMPLE_FORMAT record a sample
+BINARY_MAGIC = b"MDP1"
+# time in nanoseconds, x, y
+SAMPLE_FORMAT = struct.Struct("<qdd")
+
+
+class PositionTelemetry:
+    """
+    Records (time, x, y) samples into a bounded ring buffer that a
+    background thread flushes to disk in batches, so file writes never
+    happen on the render thread. When the buffer is full the oldest
+    samples are dropped and counted in dropped.
+    """
+
+    def __init__(self, path: str, sampleRate: int = 1, binary: bool = False,
+                 compress: bool = False, capacity: int = 4096, flushInterval: float = 0.5) -> None:
+        """Keeps one sample out of every sampleRate recorded"""
+        if sampleRate < 1:
+            raise ValueError("sampleRate must be at least 1")
+
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.sampleRate = sampleRate
+        self.binary = binary
+        self.capacity = capacity
+        self.flushInterval = flushInterval
+
+        self.dropped = 0
+        self.written = 0
+        self._counter = 0
+
+        self._buffer = collections.deque[tuple[int, float, float]](
+            maxlen=capacity)
+
+        mode = "wb" if binary else "wt"
+        self._file: IO = gzip.open(path, mode) if compress else open(
+            path, mode)  # type: ignore
+
+        if binary:
+            self._file.write(BINARY_MAGIC)
+        else:
+            self._file.write(",".join(["time", "x", "y"]) + "\n")
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="position-telemetry", daemon=True)
+        self._thread.start()
+
+    def record(self, time: int, x: float, y: float):
+        self._counter += 1
+        if self._counter < self.sampleRate:
+            return
+        self._counter = 0
+
+        if len(self._buffer) == self.capacity:
+            self.dropped += 1
+
+        self._buffer.append((time, x, y))
+
+    def _run(self):
+        while not self._stop.wait(self.flushInterval):
+            self._flush()
+
+    def _flush(self):
+        batch = list[tuple[int, float, float]]()
+
+        while len(self._buffer) > 0:
+            batch.append(self._buffer.popleft())
+
+        if len(batch) == 0:
+            return
+
+        if self.binary:
+            self._file.write(b"".join(SAMPLE_FORMAT.pack(*sample)
+                             for sample in batch))
+        else:
+            self._file.write("".join(
+                f"{time},{x},{y}\n" for (time, x, y) in batch))
+
+        self.written += len(batch)
+
+    def close(self):
+        """Writes out whatever is still buffered and closes the file"""
+        self._stop.set()
+        self._thread.join()
+
+        self._flush()
+        self._file.close()
+
+
+def readBinary(path: str) -> list[tuple[int, float, float]]:
+    """Reads back a file written with binary=True, compressed or not"""
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+
+    with (gzip.open(path, "rb") if compressed else open(path, "rb")) as file:
+        data = file.read()
+
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError(f"{path} is not a position telemetry file")
+
+    return list(SAMPLE_FORMAT.iter_unpack(data[len(BINARY_MAGIC):]))
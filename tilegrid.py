@@ -0,0 +1,558 @@
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+
+import items
+from growth import TICKS_PER_DAY, GrowthScheduler, nextStageAt
+from items import Crop
+
+if TYPE_CHECKING:
+    from controller import Tile
+
+EMPTY = 255
+NO_CROP = -1
+# due tick of a cell that has no stage change left
+NEVER = np.iinfo(np.int64).max
+# cells a side of each chunk a SparseTileGrid stores
+SPARSE_CHUNK_SIZE = 32
+# entries the growth index holds before stale ones are first dropped
+GROWTH_INDEX_SIZE = 64
+
+
+class CropTables:
+    """Growth constants of every crop, in arrays indexed by crop id for the vectorized growth math"""
+
+    def __init__(self) -> None:
+        crops = [item for item in items.registry.ofType(items.ItemType.CROP)
+                 if isinstance(item, Crop)]
+        size = max([crop.id for crop in crops], default=-1) + 1
+
+        self.crops: dict[int, Crop] = {crop.id: crop for crop in crops}
+        self.lastStage = np.zeros(size, np.int64)
+        self.growTicks = np.ones(size, np.int64)
+        self.matureTicks = np.zeros(size, np.int64)
+
+        for crop in crops:
+            self.lastStage[crop.id] = crop.stages - 1
+            self.growTicks[crop.id] = max(crop.matures * TICKS_PER_DAY, 1)
+            self.matureTicks[crop.id] = crop.matures * TICKS_PER_DAY
+
+
+class TileGrid:
+    """
+    Tiles stored as parallel arrays indexed [x, y], 19 bytes a cell. Tile
+    objects are only built when a cell is read through get, so a grid can
+    be far larger than the list of tile objects it replaces. A grid given
+    the growth scheduler and crop tables of another is one chunk of it.
+    """
+
+    def __init__(self, width: int, height: int, growth: GrowthScheduler | None = None,
+                 tables: CropTables | None = None) -> None:
+        self.width = width
+        self.height = height
+
+        self.types = np.full((width, height), EMPTY, np.uint8)
+        self.crops = np.full((width, height), NO_CROP, np.int16)
+        # tick each crop was planted on
+        self.planted = np.zeros((width, height), np.int64)
+        # tick each crop next changes growth stage on
+        self.due = np.full((width, height), NEVER, np.int64)
+
+        # due ticks and flat cell indices of the growing crops, sorted by
+        # tick, so growth only looks at the crops that are due. An entry is
+        # stale once its cell's due tick changes and is skipped
+        self._dueTicks = np.zeros(0, np.int64)
+        self._dueCells = np.zeros(0, np.int64)
+        # the index is compacted once it grows this long
+        self._compactAt = GROWTH_INDEX_SIZE
+
+        self.nextDue = int(NEVER)
+        self.growth = growth if growth != None else GrowthScheduler(self)
+        self.tables = tables if tables != None else CropTables()
+
+    def inBounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x: int, y: int) -> "Tile | None":
+        from controller import CropTile, Tile, TileType
+
+        tileType = int(self.types[x, y])
+
+        if tileType == EMPTY:
+            return None
+
+        if tileType == TileType.CROP.value:
+            tile = CropTile(self.tables.crops[int(self.crops[x, y])])
+            tile.plantedTick = int(self.planted[x, y])
+            tile.growth = self.growth
+
+            return tile
+
+        return Tile(TileType(tileType))
+
+    def set(self, x: int, y: int, tile: "Tile"):
+        from controller import CropTile
+
+        self.types[x, y] = tile.type.value
+
+        if isinstance(tile, CropTile):
+            self.crops[x, y] = tile.crop.id
+            self.planted[x, y] = tile.plantedTick
+
+            due = tile.nextStageTick
+            self.due[x, y] = NEVER if due == None else due
+            self._schedule(np.array([x]), np.array([y]))
+        else:
+            self.crops[x, y] = NO_CROP
+            self.due[x, y] = NEVER
+
+    def clear(self, x: int, y: int):
+        self.types[x, y] = EMPTY
+        self.crops[x, y] = NO_CROP
+        self.due[x, y] = NEVER
+
+    def isEmpty(self) -> bool:
+        return not np.any(self.types != EMPTY)
+
+    def reset(self):
+        """Empties every cell"""
+        self.types.fill(EMPTY)
+        self.crops.fill(NO_CROP)
+        self.due.fill(NEVER)
+
+        self._dueTicks = np.zeros(0, np.int64)
+        self._dueCells = np.zeros(0, np.int64)
+        self.nextDue = int(NEVER)
+
+    def region(self, x0: int, y0: int, x1: int, y1: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Copies of the types, crops and planted ticks of the cells with x0 <= x < x1 and y0 <= y < y1"""
+        return (self.types[x0:x1, y0:y1].copy(), self.crops[x0:x1, y0:y1].copy(),
+                self.planted[x0:x1, y0:y1].copy())
+
+    def setRegion(self, x0: int, y0: int, types: np.ndarray, crops: np.ndarray, planted: np.ndarray):
+        """
+        Overwrites the cells from x0, y0 with arrays given by region. Crops are
+        left due straight away, the next advanceGrowth works out their stages.
+        """
+        from controller import TileType
+
+        x1, y1 = x0 + types.shape[0], y0 + types.shape[1]
+
+        self.types[x0:x1, y0:y1] = types
+        self.crops[x0:x1, y0:y1] = crops
+        self.planted[x0:x1, y0:y1] = planted
+
+        isCrop = types == TileType.CROP.value
+        self.due[x0:x1, y0:y1] = np.where(isCrop, planted, NEVER)
+
+        xs, ys = np.nonzero(isCrop)
+        self._schedule(xs + x0, ys + y0)
+
+    def occupiedChunks(self, size: int) -> "set[tuple[int, int]]":
+        """Positions of the size by size chunks with a tile in them"""
+        columns, rows = -(-self.width // size), -(-self.height // size)
+
+        occupied = np.zeros((columns * size, rows * size), bool)
+        occupied[:self.width, :self.height] = self.types != EMPTY
+        cxs, cys = np.nonzero(occupied.reshape(
+            columns, size, rows, size).any(axis=(1, 3)))
+
+        return set(zip(cxs.tolist(), cys.tolist()))
+
+    def typesAt(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        return self.types[xs, ys]
+
+    def cropsAt(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        return self.crops[xs, ys]
+
+    def setMany(self, xs: np.ndarray, ys: np.ndarray, tileType: int):
+        """Puts a plain tile of tileType at every (xs[i], ys[i])"""
+        self.types[xs, ys] = tileType
+        self.crops[xs, ys] = NO_CROP
+        self.due[xs, ys] = NEVER
+
+    def clearMany(self, xs: np.ndarray, ys: np.ndarray):
+        self.setMany(xs, ys, EMPTY)
+
+    def plantMany(self, xs: np.ndarray, ys: np.ndarray, crop: Crop, tick: int):
+        """Plants crop on tick at every (xs[i], ys[i])"""
+        from controller import TileType
+
+        if len(xs) == 0:
+            return
+
+        due = nextStageAt(crop, 0)
+        due = NEVER if due == None else tick + due
+
+        self.types[xs, ys] = TileType.CROP.value
+        self.crops[xs, ys] = crop.id
+        self.planted[xs, ys] = tick
+        self.due[xs, ys] = due
+        self._schedule(xs, ys)
+
+    def matureAt(self, xs: np.ndarray, ys: np.ndarray, tick: int) -> np.ndarray:
+        """Which of the cells hold a crop that is mature on tick"""
+        from controller import TileType
+
+        crops = self.crops[xs, ys]
+        isCrop = self.types[xs, ys] == TileType.CROP.value
+        elapsed = tick - self.planted[xs, ys]
+
+        return isCrop & (elapsed >= self.tables.matureTicks[np.where(isCrop, crops, 0)])
+
+    def populated(self) -> Iterator[tuple[int, int]]:
+        """Positions of every non empty cell, column by column"""
+        xs, ys = np.nonzero(self.types != EMPTY)
+
+        return zip(xs.tolist(), ys.tolist())
+
+    def populatedIn(self, x0: int, y0: int, x1: int, y1: int) -> list[tuple[int, int]]:
+        """Positions of the non empty cells with x0 <= x < x1 and y0 <= y < y1, column by column"""
+        x0, y0 = max(x0, 0), max(y0, 0)
+        xs, ys = np.nonzero(self.types[x0:x1, y0:y1] != EMPTY)
+
+        return list(zip((xs + x0).tolist(), (ys + y0).tolist()))
+
+    def _schedule(self, xs: np.ndarray, ys: np.ndarray):
+        """Adds the cells to the growth index at their due ticks, cells never due are left out"""
+        cells = np.ravel_multi_index((xs, ys), self.due.shape)
+        ticks = self.due.reshape(-1)[cells]
+
+        growing = ticks != NEVER
+        cells, ticks = cells[growing], ticks[growing]
+
+        if len(cells) == 0:
+            return
+
+        order = np.argsort(ticks, kind="stable")
+        at = np.searchsorted(self._dueTicks, ticks[order], side="right")
+        self._dueTicks = np.insert(self._dueTicks, at, ticks[order])
+        self._dueCells = np.insert(self._dueCells, at, cells[order])
+
+        if len(self._dueTicks) > self._compactAt:
+            self._compact()
+
+        self.nextDue = min(self.nextDue, int(self._dueTicks[0]))
+
+    def _live(self, ticks: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        """Which of the index entries still match their cell's due tick"""
+        return self.due.reshape(-1)[cells] == ticks
+
+    def _compact(self):
+        """Drops stale and repeated entries from the growth index"""
+        live = self._live(self._dueTicks, self._dueCells)
+        ticks, cells = self._dueTicks[live], self._dueCells[live]
+
+        # a cell is due on one tick, so its first live entry is enough
+        _, first = np.unique(cells, return_index=True)
+        first.sort()
+
+        self._dueTicks, self._dueCells = ticks[first], cells[first]
+        self._compactAt = max(GROWTH_INDEX_SIZE, 2 * len(first))
+
+    @property
+    def growingCount(self) -> int:
+        if len(self._dueCells) == 0:
+            return 0
+
+        live = self._live(self._dueTicks, self._dueCells)
+
+        return len(_distinct(self._dueCells[live]))
+
+    def advanceGrowth(self, tick: int) -> list[tuple[int, int]]:
+        """Moves every crop due by tick to its current stage, returns the moved positions"""
+        if tick < self.nextDue:
+            return []
+
+        end = int(np.searchsorted(self._dueTicks, tick, side="right"))
+        ticks, cells = self._dueTicks[:end], self._dueCells[:end]
+        self._dueTicks, self._dueCells = self._dueTicks[end:], self._dueCells[end:]
+
+        index = _distinct(cells[self._live(ticks, cells)])
+
+        due = self.due.reshape(-1)
+        crops = self.crops.reshape(-1)[index]
+        planted = self.planted.reshape(-1)[index]
+        last = self.tables.lastStage[crops]
+        growTicks = self.tables.growTicks[crops]
+
+        # same rounding as growth.growthStage and growth.nextStageAt
+        elapsed = tick - planted
+        stage = np.where(elapsed >= growTicks, last,
+                         ((2 * last * elapsed) + growTicks) // (2 * growTicks))
+        nextDue = planted + \
+            -(-((2 * stage) + 1) * growTicks // np.maximum(2 * last, 1))
+
+        due[index] = np.where(stage >= last, NEVER, nextDue)
+
+        xs, ys = np.unravel_index(index, self.due.shape)
+        self._schedule(xs, ys)
+
+        # stale entries at the front would only make nextDue early
+        start = 0
+        while start < len(self._dueTicks) and due[self._dueCells[start]] != self._dueTicks[start]:
+            start += 1
+        self._dueTicks, self._dueCells = self._dueTicks[start:], self._dueCells[start:]
+
+        self.nextDue = int(self._dueTicks[0]) if len(
+            self._dueTicks) > 0 else int(NEVER)
+
+        return list(zip(xs.tolist(), ys.tolist()))
+
+
+def _distinct(values: np.ndarray) -> np.ndarray:
+    """The sorted distinct values, cheaper than np.unique for the few a tick has due"""
+    if len(values) < 2:
+        return values
+
+    values = np.sort(values)
+
+    return values[np.concatenate(([True], values[1:] != values[:-1]))]
+
+
+class SparseTileGrid:
+    """
+    The TileGrid interface over a dict of TileGrid chunks keyed by chunk
+    position, holding only the chunks that have tiles in them. Memory and
+    the cost of growth updates and iterating tiles scale with the land
+    that is farmed, not with the size of the map.
+    """
+
+    def __init__(self, width: int, height: int, chunkSize: int = SPARSE_CHUNK_SIZE) -> None:
+        self.width = width
+        self.height = height
+        self.chunkSize = chunkSize
+
+        self.chunks = dict[tuple[int, int], TileGrid]()
+
+        self.nextDue = int(NEVER)
+        self.growth = GrowthScheduler(self)
+        self.tables = CropTables()
+
+    def inBounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def _chunk(self, x: int, y: int, create: bool = False) -> TileGrid | None:
+        key = (x // self.chunkSize, y // self.chunkSize)
+        chunk = self.chunks.get(key)
+
+        if chunk == None and create:
+            chunk = self.chunks[key] = TileGrid(
+                self.chunkSize, self.chunkSize, self.growth, self.tables)
+
+        return chunk
+
+    def _dropIfEmpty(self, key: tuple[int, int]):
+        if self.chunks[key].isEmpty():
+            del self.chunks[key]
+
+    def _groups(self, xs: np.ndarray, ys: np.ndarray) -> Iterator[tuple[tuple[int, int], np.ndarray]]:
+        """Splits cells xs, ys by chunk, yields each chunk key with the indices of its cells"""
+        if len(xs) == 0:
+            return
+
+        cxs, cys = xs // self.chunkSize, ys // self.chunkSize
+        keys = (cxs.astype(np.int64) * (self.height // self.chunkSize + 1)) + cys
+
+        order = np.argsort(keys, kind="stable")
+        splits = np.flatnonzero(np.diff(keys[order])) + 1
+
+        for index in np.split(order, splits):
+            first = index[0]
+            yield (int(cxs[first]), int(cys[first])), index
+
+    def get(self, x: int, y: int) -> "Tile | None":
+        chunk = self._chunk(x, y)
+
+        if chunk == None:
+            return None
+
+        return chunk.get(x % self.chunkSize, y % self.chunkSize)
+
+    def set(self, x: int, y: int, tile: "Tile"):
+        chunk = self._chunk(x, y, create=True)
+        assert (chunk != None)
+
+        chunk.set(x % self.chunkSize, y % self.chunkSize, tile)
+        self.nextDue = min(self.nextDue, chunk.nextDue)
+
+    def clear(self, x: int, y: int):
+        chunk = self._chunk(x, y)
+
+        if chunk != None:
+            chunk.clear(x % self.chunkSize, y % self.chunkSize)
+            self._dropIfEmpty((x // self.chunkSize, y // self.chunkSize))
+
+    def isEmpty(self) -> bool:
+        return len(self.chunks) == 0
+
+    def reset(self):
+        self.chunks.clear()
+        self.nextDue = int(NEVER)
+
+    def _overlapping(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[tuple[tuple[int, int], slice, slice, slice, slice]]:
+        """
+        Every chunk position touching the cells with x0 <= x < x1 and
+        y0 <= y < y1, with the slices of the chunk and of the region they share
+        """
+        size = self.chunkSize
+
+        for cx in range(x0 // size, -(-x1 // size)):
+            for cy in range(y0 // size, -(-y1 // size)):
+                left, top = max(x0, cx * size), max(y0, cy * size)
+                right, bottom = min(x1, (cx + 1) * size), min(y1,
+                                                              (cy + 1) * size)
+
+                yield ((cx, cy), slice(left - (cx * size), right - (cx * size)),
+                       slice(top - (cy * size), bottom - (cy * size)),
+                       slice(left - x0, right - x0), slice(top - y0, bottom - y0))
+
+    def region(self, x0: int, y0: int, x1: int, y1: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        shape = (x1 - x0, y1 - y0)
+        types = np.full(shape, EMPTY, np.uint8)
+        crops = np.full(shape, NO_CROP, np.int16)
+        planted = np.zeros(shape, np.int64)
+
+        for key, chunkX, chunkY, regionX, regionY in self._overlapping(x0, y0, x1, y1):
+            chunk = self.chunks.get(key)
+
+            if chunk != None:
+                types[regionX, regionY] = chunk.types[chunkX, chunkY]
+                crops[regionX, regionY] = chunk.crops[chunkX, chunkY]
+                planted[regionX, regionY] = chunk.planted[chunkX, chunkY]
+
+        return (types, crops, planted)
+
+    def setRegion(self, x0: int, y0: int, types: np.ndarray, crops: np.ndarray, planted: np.ndarray):
+        x1, y1 = x0 + types.shape[0], y0 + types.shape[1]
+
+        for key, chunkX, chunkY, regionX, regionY in self._overlapping(x0, y0, x1, y1):
+            if key not in self.chunks and np.all(types[regionX, regionY] == EMPTY):
+                continue
+
+            chunk = self._chunk(key[0] * self.chunkSize,
+                                key[1] * self.chunkSize, create=True)
+            assert (chunk != None)
+
+            start = (chunkX.start, chunkY.start)
+            chunk.setRegion(*start, types[regionX, regionY],
+                            crops[regionX, regionY], planted[regionX, regionY])
+            self.nextDue = min(self.nextDue, chunk.nextDue)
+
+            self._dropIfEmpty(key)
+
+    def occupiedChunks(self, size: int) -> "set[tuple[int, int]]":
+        if size == self.chunkSize:
+            return set(self.chunks)
+
+        return {(x // size, y // size) for (x, y) in self.populated()}
+
+    def typesAt(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        types = np.full(len(xs), EMPTY, np.uint8)
+
+        for key, index in self._groups(xs, ys):
+            if key in self.chunks:
+                types[index] = self.chunks[key].typesAt(
+                    xs[index] % self.chunkSize, ys[index] % self.chunkSize)
+
+        return types
+
+    def cropsAt(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        crops = np.full(len(xs), NO_CROP, np.int16)
+
+        for key, index in self._groups(xs, ys):
+            if key in self.chunks:
+                crops[index] = self.chunks[key].cropsAt(
+                    xs[index] % self.chunkSize, ys[index] % self.chunkSize)
+
+        return crops
+
+    def setMany(self, xs: np.ndarray, ys: np.ndarray, tileType: int):
+        for key, index in self._groups(xs, ys):
+            if tileType == EMPTY and key not in self.chunks:
+                continue
+
+            chunk = self._chunk(key[0] * self.chunkSize,
+                                key[1] * self.chunkSize, create=True)
+            assert (chunk != None)
+
+            chunk.setMany(xs[index] % self.chunkSize,
+                          ys[index] % self.chunkSize, tileType)
+
+            if tileType == EMPTY:
+                self._dropIfEmpty(key)
+
+    def clearMany(self, xs: np.ndarray, ys: np.ndarray):
+        self.setMany(xs, ys, EMPTY)
+
+    def plantMany(self, xs: np.ndarray, ys: np.ndarray, crop: Crop, tick: int):
+        for key, index in self._groups(xs, ys):
+            chunk = self._chunk(key[0] * self.chunkSize,
+                                key[1] * self.chunkSize, create=True)
+            assert (chunk != None)
+
+            chunk.plantMany(xs[index] % self.chunkSize,
+                            ys[index] % self.chunkSize, crop, tick)
+            self.nextDue = min(self.nextDue, chunk.nextDue)
+
+    def matureAt(self, xs: np.ndarray, ys: np.ndarray, tick: int) -> np.ndarray:
+        mature = np.zeros(len(xs), bool)
+
+        for key, index in self._groups(xs, ys):
+            if key in self.chunks:
+                mature[index] = self.chunks[key].matureAt(
+                    xs[index] % self.chunkSize, ys[index] % self.chunkSize, tick)
+
+        return mature
+
+    def populated(self) -> Iterator[tuple[int, int]]:
+        """Positions of every non empty cell, column by column"""
+        return iter(self.populatedIn(0, 0, self.width, self.height))
+
+    def populatedIn(self, x0: int, y0: int, x1: int, y1: int) -> list[tuple[int, int]]:
+        """Positions of the non empty cells with x0 <= x < x1 and y0 <= y < y1, column by column"""
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+
+        xs, ys = list[np.ndarray](), list[np.ndarray]()
+        for key, chunkX, chunkY, regionX, regionY in self._overlapping(x0, y0, x1, y1):
+            chunk = self.chunks.get(key)
+
+            if chunk == None:
+                continue
+
+            cellXs, cellYs = np.nonzero(chunk.types[chunkX, chunkY] != EMPTY)
+            xs.append(cellXs + x0 + regionX.start)
+            ys.append(cellYs + y0 + regionY.start)
+
+        if len(xs) == 0:
+            return []
+
+        allXs, allYs = np.concatenate(xs), np.concatenate(ys)
+        order = np.lexsort((allYs, allXs))
+
+        return list(zip(allXs[order].tolist(), allYs[order].tolist()))
+
+    @property
+    def growingCount(self) -> int:
+        return sum(chunk.growingCount for chunk in self.chunks.values())
+
+    def advanceGrowth(self, tick: int) -> list[tuple[int, int]]:
+        """Moves every crop due by tick to its current stage, returns the moved positions"""
+        if tick < self.nextDue:
+            return []
+
+        moved = list[tuple[int, int]]()
+        nextDue = int(NEVER)
+
+        for (cx, cy), chunk in self.chunks.items():
+            if chunk.nextDue <= tick:
+                left, top = cx * self.chunkSize, cy * self.chunkSize
+                moved.extend((left + x, top + y)
+                             for (x, y) in chunk.advanceGrowth(tick))
+
+            nextDue = min(nextDue, chunk.nextDue)
+
+        self.nextDue = nextDue
+
+        return moved
@@ -0,0 +1,39 @@
+import time
+
+
+class Clock:
+    """Source of time in nanoseconds for the world and its characters"""
+
+    def now(self) -> int:
+        raise NotImplementedError()
+
+
+class SystemClock(Clock):
+    def now(self) -> int:
+        return time.time_ns()
+
+
+class FixedClock(Clock):
+    """Only moves when advanced, so simulations are deterministic and can run faster than real time"""
+
+    def __init__(self, start: int = 0) -> None:
+        self.time = start
+
+    def now(self) -> int:
+        return self.time
+
+    def advance(self, nanoseconds: int):
+        self.time += nanoseconds
+
+
+class FrameClock(Clock):
+    """The system time read once a frame by tick, so everything updated in a frame sees the same time"""
+
+    def __init__(self) -> None:
+        self.time = time.time_ns()
+
+    def now(self) -> int:
+        return self.time
+
+    def tick(self):
+        self.time = time.time_ns()